@@ -3,34 +3,30 @@
 import machine
 import utime
 import ujson
-try:
-    import ssd1306
-except:
-    ssd1306 = None
+from micropython import const
 from fifo import Fifo
+import oled_util
+import time_util
+import button_util
+from oled_util import show_text as show_text_on_oled
 
 # ----------------- CONFIG -----------------
-I2C_SCL = 15
-I2C_SDA = 14
-OLED_ENABLED = ssd1306 is not None
-OLED_WIDTH = 128
-OLED_HEIGHT = 64
 ENC_A, ENC_B, ENC_BTN = 10, 11, 12
 EXIT_BTN = 9  # SW_0 button
-HISTORY_FILE = "hrv_history.json"
+HISTORY_FILE = "hrv_history.jsonl"  # One JSON entry per line, oldest first
+LEGACY_HISTORY_FILE = "hrv_history.json"  # Older versions: one JSON array of dicts, newest first
 MAX_HISTORY_ENTRIES = 20
+COMPACT_THRESHOLD = MAX_HISTORY_ENTRIES * 2  # Rewrite the log once it grows past this
+DEBUG = const(0)  # Set to 1 for verbose logging, 0 compiles the debug prints out
+
+# Entries are stored as lists in this field order (same fields as a Kubios
+# database record plus display extras) so key names are not repeated per entry
+FIELDS = ("mac", "timestamp", "mean_hr", "mean_ppi", "rmssd", "sdnn", "sns", "pns",
+          "patient_id", "patient_name", "readiness", "stress_index", "physiological_age")
+FIELD_INDEX = {name: i for i, name in enumerate(FIELDS)}
 
 # ----------------- HARDWARE -----------------
-if OLED_ENABLED:
-    try:
-        i2c = machine.I2C(1, scl=machine.Pin(I2C_SCL),
-                          sda=machine.Pin(I2C_SDA), freq=400000)
-        oled = ssd1306.SSD1306_I2C(OLED_WIDTH, OLED_HEIGHT, i2c)
-    except:
-        oled = None
-        print("OLED initialization failed")
-else:
-    oled = None
+oled = None  # Shared display from oled_util, set up in run()
 
 # ----- ENCODER USING INTERRUPT + FIFO -----
 class Encoder:
@@ -68,77 +64,156 @@ def init_hardware():
     if exit_btn is None:
         exit_btn = machine.Pin(EXIT_BTN, machine.Pin.IN, machine.Pin.PULL_UP)
 
+# ----- BUTTONS USING INTERRUPT + EDGE LATCH -----
+btn_irq = None
+exit_button_irq = None
+
+def attach_button_irqs():
+    """Latch button presses from falling edges so the main loop never has to block"""
+    global btn_irq, exit_button_irq
+    # Built per run, the menu may hand us its own exit button
+    btn_irq = button_util.Button(btn)
+    exit_button_irq = button_util.Button(exit_btn)
+    btn_irq.attach()
+    exit_button_irq.attach()
+
+def detach_button_irqs():
+    """Release button interrupts when leaving, the pins are shared with the menu"""
+    btn_irq.detach()
+    exit_button_irq.detach()
+
 # ----------------- GLOBALS -----------------
 current_page = 0
 history_data = []
+history_lines = None  # Lines in HISTORY_FILE, None until counted
+_history_loaded = False
+_ujson_warmed = False
+_appended = False  # Set after the first append since boot
+_ts_short = {}   # timestamp -> formatted list view string
+_ts_detail = {}  # timestamp -> formatted details view string
 
-# ----------------- DISPLAY -----------------
-def show_text_on_oled(lines):
-    if oled is None:
-        return
-    oled.fill(0)
-    y = 0
-    for line in lines:
-        oled.text(str(line), 0, y)
-        y += 10
-        if y > OLED_HEIGHT-10:
-            break
-    oled.show()
+# ----------------- HISTORY ENTRIES -----------------
+def field(entry, name):
+    """Get a named field from a history entry"""
+    return entry[FIELD_INDEX[name]]
+
+def entry_from_dict(d):
+    """Convert a dict style entry (older history files) to the list layout"""
+    return [d.get(name, 0) for name in FIELDS]
 
 # ----------------- HISTORY MANAGEMENT -----------------
-def load_history():
-    """Load history from file"""
-    global history_data
+def migrate_legacy_history():
+    """One-time conversion of LEGACY_HISTORY_FILE to the line log, True if it was done"""
     try:
-        print("Attempting to load from:", HISTORY_FILE)
-        with open(HISTORY_FILE, 'r') as f:
+        open(HISTORY_FILE, 'rb').close()
+        return False  # Already on the line log
+    except OSError:
+        pass
+    try:
+        with open(LEGACY_HISTORY_FILE, 'r') as f:
             content = f.read().strip()
-            print("File content length:", len(content))
-            if content:
-                history_data = ujson.loads(content)
-            else:
-                history_data = []
-        print("Loaded %d history entries" % len(history_data))
+    except OSError:
+        return False  # Nothing to migrate
+    try:
+        old = ujson.loads(content) if content else []
+        old = old[:MAX_HISTORY_ENTRIES]
+        with open(HISTORY_FILE, 'w') as f:
+            for i in range(len(old) - 1, -1, -1):
+                entry = old[i]
+                ujson.dump(entry_from_dict(entry) if isinstance(entry, dict) else entry, f)
+                f.write('\n')
+        print("Migrated %d entries from %s" % (len(old), LEGACY_HISTORY_FILE))
+        return True
+    except Exception as e:
+        print("Could not migrate old history:", e)
+        return False
+
+def load_history():
+    """Load history from file, returns False if the file could not be read"""
+    global history_data, history_lines, _history_loaded, _ujson_warmed
+    _ts_short.clear()
+    _ts_detail.clear()
+    try:
+        if DEBUG:
+            print("Attempting to load from:", HISTORY_FILE)
+        # MicroPython's ujson.loads runs several times faster once ujson.dumps
+        # has been called in the process, so prime it before the first parse.
+        if not _ujson_warmed:
+            ujson.dumps(None)
+            _ujson_warmed = True
+        entries = []
+        lines = 0
+        with open(HISTORY_FILE, 'rb') as f:
+            # Parse line by line instead of reading the whole file at once
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                lines += 1
+                try:
+                    entry = ujson.loads(line)
+                except ValueError:
+                    # Torn line from a power cut during an append, skip it
+                    print("Skipping unreadable history line")
+                    continue
+                if isinstance(entry, list):
+                    entries.append(entry)
+        history_lines = lines
+        # File is oldest first, history_data is newest first
+        entries.reverse()
+        history_data = entries[:MAX_HISTORY_ENTRIES]
+        if DEBUG:
+            print("Loaded %d history entries" % len(history_data))
+        _history_loaded = True
+        return True
     except OSError as e:
+        if migrate_legacy_history():
+            return load_history()
         print("File not found (OSError):", e)
         history_data = []
+        history_lines = 0
+        _history_loaded = True
         print("No history file found, starting fresh")
         # Try to create an empty file
         try:
             with open(HISTORY_FILE, 'w') as f:
-                f.write('[]')
+                pass
             print("Created empty history file")
         except Exception as create_error:
             print("Could not create empty file:", create_error)
+        return True
     except Exception as e:
         print("Error loading history:", e)
         history_data = []
+        return False
+
+def ensure_history_loaded():
+    """Load history from file only if it has not been loaded yet"""
+    if not _history_loaded:
+        load_history()
 
 def save_history():
-    """Save history to file"""
+    """Rewrite the history file from history_data"""
+    global history_lines
     try:
-        # Keep only the most recent entries
+        # Keep only the most recent entries (list is newest first)
         if len(history_data) > MAX_HISTORY_ENTRIES:
-            history_data[:] = history_data[-MAX_HISTORY_ENTRIES:]
+            history_data[:] = history_data[:MAX_HISTORY_ENTRIES]
         
-        print("Attempting to save to:", HISTORY_FILE)
-        print("Data to save:", history_data)
+        if DEBUG:
+            print("Attempting to save to:", HISTORY_FILE)
+            print("Data to save:", history_data)
         
-        # Create the file with explicit path
+        # Write oldest first so new entries can simply be appended
         with open(HISTORY_FILE, 'w') as f:
-            json_str = ujson.dumps(history_data)
-            f.write(json_str)
+            for i in range(len(history_data) - 1, -1, -1):
+                ujson.dump(history_data[i], f)  # Encode straight into the file
+                f.write('\n')
             f.flush()  # Ensure data is written
+        history_lines = len(history_data)
         
-        # Verify the file was created
-        try:
-            with open(HISTORY_FILE, 'r') as f:
-                content = f.read()
-                print("File created successfully, content length:", len(content))
-        except:
-            print("Warning: Could not verify file creation")
-        
-        print("History saved (%d entries)" % len(history_data))
+        if DEBUG:
+            print("History saved (%d entries)" % len(history_data))
         return True
     except Exception as e:
         print("Failed to save history:", e)
@@ -147,35 +222,65 @@ def save_history():
         sys.print_exception(e)
         return False
 
-def add_history_entry(analysis_data):
+def count_history_lines():
+    """Count entries in the history file without parsing them"""
+    count = 0
+    try:
+        with open(HISTORY_FILE, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    count += 1
+    except OSError:
+        pass
+    return count
+
+def append_history(entry):
+    """Append a single entry to the end of the history file"""
+    global history_lines, _appended
+    line = (ujson.dumps(entry) + "\n").encode()
+    if history_lines is None:
+        migrate_legacy_history()
+        history_lines = count_history_lines()
+    if not _appended:
+        # First append since boot: start on a fresh line in case the last one
+        # was torn by a power cut (empty lines are skipped on load)
+        line = b"\n" + line
+    try:
+        # Encode the whole line once and append it in a single binary write
+        with open(HISTORY_FILE, 'ab') as f:
+            f.write(line)
+        _appended = True
+        history_lines += 1
+    except Exception as e:
+        print("Failed to append history:", e)
+        return False
+    
+    if history_lines > COMPACT_THRESHOLD:
+        return compact_history()
+    return True
+
+def compact_history():
+    """Rewrite the history file keeping only the most recent entries"""
+    if DEBUG:
+        print("Compacting history file (%d lines)" % history_lines)
+    if not load_history():
+        # Never rewrite the file from a failed read, that would wipe it
+        return False
+    return save_history()
+
+def add_history_entry(analysis_data, timestamp=None):
     """Add new HRV analysis to history using same format as Kubios database"""
     if analysis_data is None:
         print("No analysis data provided")
         return False
     
     try:
-        print("Adding history entry...")
+        if DEBUG:
+            print("Adding history entry...")
         
-        # Load current history first
-        load_history()
-        
-        # Get real current timestamp using same function as Kubios
-        try:
-            import ntptime
-            # Sync with NTP server to get real time
-            print("Syncing time with NTP server...")
-            ntptime.settime()
-            # After ntptime.settime(), utime.time() returns Unix timestamp directly
-            timestamp = utime.time()
-            print("Time synced, timestamp:", timestamp)
-        except Exception as e:
-            print("NTP sync failed, using approximate time:", e)
-            # Fallback: use approximate current time (December 4, 2025 9:06 UTC)
-            # Current Unix timestamp for Dec 4, 2025 9:06 UTC is 1764839160
-            base_time = 1764839160  # Dec 4, 2025 9:06 UTC 
-            device_uptime_offset = utime.ticks_ms() // 1000  # Convert ms to seconds
-            timestamp = base_time + device_uptime_offset
-            print("Using approximate timestamp:", timestamp)
+        # Same timestamp as the database record when the caller has one
+        if timestamp is None:
+            timestamp = time_util.get_timestamp()
         
         # Import config from KubiosHRV
         try:
@@ -189,37 +294,43 @@ def add_history_entry(analysis_data):
             patient_name = "HRV User"
             patient_id = 1
         
-        # Create entry using same format as Kubios database record
-        entry = {
-            "mac": device_mac,
-            "timestamp": timestamp,
-            "mean_hr": float(analysis_data.get('mean_hr_bpm', 0)),
-            "mean_ppi": float(analysis_data.get('mean_rr_ms', 0)),  # PPI is same as RR interval
-            "rmssd": float(analysis_data.get('rmssd_ms', 0)),
-            "sdnn": float(analysis_data.get('sdnn_ms', 0)),
-            "sns": float(analysis_data.get('sns_index', 0)),
-            "pns": float(analysis_data.get('pns_index', 0)),
-            "patient_id": patient_id,
+        # Create entry with the same fields as a Kubios database record (order of FIELDS)
+        entry = [
+            device_mac,
+            timestamp,
+            float(analysis_data.get('mean_hr_bpm', 0)),
+            float(analysis_data.get('mean_rr_ms', 0)),  # PPI is same as RR interval
+            float(analysis_data.get('rmssd_ms', 0)),
+            float(analysis_data.get('sdnn_ms', 0)),
+            float(analysis_data.get('sns_index', 0)),
+            float(analysis_data.get('pns_index', 0)),
+            patient_id,
             # Additional fields for display
-            "patient_name": patient_name,
-            "readiness": float(analysis_data.get('readiness', 0)),
-            "stress_index": float(analysis_data.get('stress_index', 0)),
-            "physiological_age": int(analysis_data.get('physiological_age', 0))
-        }
+            patient_name,
+            float(analysis_data.get('readiness', 0)),
+            float(analysis_data.get('stress_index', 0)),
+            int(analysis_data.get('physiological_age', 0))
+        ]
         
-        print("Created Kubios-format entry:", entry)
+        if DEBUG:
+            print("Created Kubios-format entry:", entry)
         
         # Add to beginning of list (newest first)
         history_data.insert(0, entry)
-        print("Added to history_data, new length:", len(history_data))
+        if len(history_data) > MAX_HISTORY_ENTRIES:
+            history_data.pop()
+        if DEBUG:
+            print("Added to history_data, new length:", len(history_data))
         
-        # Save to file
-        save_result = save_history()
-        print("Save result:", save_result)
+        # Append to file
+        save_result = append_history(entry)
+        if DEBUG:
+            print("Save result:", save_result)
         
         if save_result:
-            print("Added entry to history: Score=%.1f, HR=%.1f, Patient=%s" % 
-                  (entry["readiness"], entry["mean_hr"], entry["patient_name"]))
+            if DEBUG:
+                print("Added entry to history: Score=%.1f, HR=%.1f, Patient=%s" % 
+                      (field(entry, "readiness"), field(entry, "mean_hr"), field(entry, "patient_name")))
             return True
         else:
             print("Failed to save history to file")
@@ -249,11 +360,13 @@ def format_timestamp_detailed(timestamp):
 
 def clear_history():
     """Clear all history"""
-    global history_data
+    global history_data, history_lines, _history_loaded
     history_data = []
     try:
         with open(HISTORY_FILE, 'w') as f:
-            f.write('[]')
+            pass
+        history_lines = 0
+        _history_loaded = True
         print("History cleared")
         return True
     except:
@@ -265,6 +378,7 @@ def display_history_list():
     """Display list of history entries"""
     global current_page
     
+    ensure_history_loaded()
     if not history_data:
         show_text_on_oled([
             "HRV HISTORY",
@@ -288,10 +402,14 @@ def display_history_list():
     
     for i in range(start_idx, end_idx):
         entry = history_data[i]
-        time_str = format_timestamp(entry["timestamp"])
-        score = entry.get("readiness", 0)
-        hr = entry["mean_hr"]
-        stress = entry.get("stress_index", 0)
+        # Timestamps never change, format each one only once
+        timestamp = field(entry, "timestamp")
+        time_str = _ts_short.get(timestamp)
+        if time_str is None:
+            time_str = _ts_short[timestamp] = format_timestamp(timestamp)
+        score = field(entry, "readiness")
+        hr = field(entry, "mean_hr")
+        stress = field(entry, "stress_index")
         
         line = "%d.%s S:%.0f H:%.0f St:%.0f" % (i+1, time_str, score, hr, stress)
         lines.append(line)
@@ -312,16 +430,19 @@ def display_history_details(entry_index):
         return False
     
     entry = history_data[entry_index]
-    time_str = format_timestamp_detailed(entry["timestamp"])
-    patient_name = entry.get("patient_name", "Unknown")
+    timestamp = field(entry, "timestamp")
+    time_str = _ts_detail.get(timestamp)
+    if time_str is None:
+        time_str = _ts_detail[timestamp] = format_timestamp_detailed(timestamp)
+    patient_name = field(entry, "patient_name") or "Unknown"
     
     show_text_on_oled([
         "ENTRY #%d DETAILS" % (entry_index + 1),
         "Patient: %s" % patient_name,
         "Time: %s" % time_str,
-        "Score: %.1f" % entry.get("readiness", 0),
-        "HR: %.1f bpm" % entry["mean_hr"],
-        "Stress: %.1f" % entry.get("stress_index", 0),
+        "Score: %.1f" % field(entry, "readiness"),
+        "HR: %.1f bpm" % field(entry, "mean_hr"),
+        "Stress: %.1f" % field(entry, "stress_index"),
         "Rot: nav  Btn: back"
     ])
     return True
@@ -330,15 +451,19 @@ def display_history_details(entry_index):
 def run(exit_button=None, display=None, enc=None):
     global current_page, oled, exit_btn, btn, encoder
     
+    # The display may have been drawn by someone else since our last frame
+    oled_util.invalidate()
+    
     # Set up hardware references
     if enc is not None:
         # Called from menu - use shared hardware
         encoder = enc
         exit_btn = exit_button if exit_button else machine.Pin(EXIT_BTN, machine.Pin.IN, machine.Pin.PULL_UP)
-        oled = display
+        oled = oled_util.set_display(display)
         btn = machine.Pin(ENC_BTN, machine.Pin.IN, machine.Pin.PULL_UP)  # Encoder button
     else:
         # Standalone mode - initialize our own hardware
+        oled = oled_util.init_oled()
         if exit_btn is None:
             exit_btn = machine.Pin(EXIT_BTN, machine.Pin.IN, machine.Pin.PULL_UP)
         if encoder is None:
@@ -353,26 +478,28 @@ def run(exit_button=None, display=None, enc=None):
     
     print("HRV History starting...")
     
-    # Load history data
-    load_history()
+    # Load history data (kept in memory after the first load)
+    ensure_history_loaded()
     
     # Reset page
     current_page = 0
     view_mode = "list"  # "list" or "details"
     selected_entry = 0
     entries_per_page = 3
+    last_render = None  # View shown on the display, redraw only when it changes
     
     if oled:
         show_text_on_oled(["HRV HISTORY", "Loading..."])
     
-    while True:
-        # Exit button check
-        if not exit_btn.value():
-            utime.sleep_ms(50)
-            if not exit_btn.value():
+    attach_button_irqs()
+    try:
+        while True:
+            # Exit button check (edge latched and debounced by the IRQ)
+            if exit_button_irq.pressed():
                 # Clear encoder FIFO when exiting to prevent crashes
                 if encoder and encoder.fifo.has_data():
-                    print("Clearing encoder FIFO on exit...")
+                    if DEBUG:
+                        print("Clearing encoder FIFO on exit...")
                     while encoder.fifo.has_data():
                         encoder.fifo.get()
                 
@@ -380,38 +507,39 @@ def run(exit_button=None, display=None, enc=None):
                     show_text_on_oled(["Exiting..."])
                 print("Exiting HRV History")
                 return
-        
-        # Display current view
-        if view_mode == "list":
-            display_history_list()
-        elif view_mode == "details":
-            if not display_history_details(selected_entry):
-                view_mode = "list"
-                continue
-        
-        # Rotary encoder navigation for pages/entries
-        if encoder and encoder.fifo.has_data():
-            move = encoder.fifo.get()
-            if view_mode == "list":
-                if history_data:
-                    total_pages = (len(history_data) + entries_per_page - 1) // entries_per_page
-                    if total_pages > 1:
-                        # Navigate pages with encoder
-                        if move > 0:
-                            current_page = (current_page + 1) % total_pages
-                        else:  # move < 0 (backward)
-                            current_page = (current_page - 1) % total_pages
-            elif view_mode == "details":
-                # Navigate between entries with encoder
-                if move > 0:
-                    selected_entry = (selected_entry + 1) % len(history_data)
-                else:  # move < 0 (backward)
-                    selected_entry = (selected_entry - 1) % len(history_data)
-        
-        # Encoder button for selecting/entering details
-        if not btn.value():
-            utime.sleep_ms(50)
-            if not btn.value():
+            
+            # Display current view (skipped when nothing has changed)
+            view_key = (current_page, view_mode, len(history_data), selected_entry)
+            if view_key != last_render:
+                if view_mode == "list":
+                    display_history_list()
+                elif view_mode == "details":
+                    if not display_history_details(selected_entry):
+                        view_mode = "list"
+                        continue
+                last_render = view_key
+            
+            # Rotary encoder navigation for pages/entries
+            if encoder and encoder.fifo.has_data():
+                move = encoder.fifo.get()
+                if view_mode == "list":
+                    if history_data:
+                        total_pages = (len(history_data) + entries_per_page - 1) // entries_per_page
+                        if total_pages > 1:
+                            # Navigate pages with encoder
+                            if move > 0:
+                                current_page = (current_page + 1) % total_pages
+                            else:  # move < 0 (backward)
+                                current_page = (current_page - 1) % total_pages
+                elif view_mode == "details":
+                    # Navigate between entries with encoder
+                    if move > 0:
+                        selected_entry = (selected_entry + 1) % len(history_data)
+                    else:  # move < 0 (backward)
+                        selected_entry = (selected_entry - 1) % len(history_data)
+            
+            # Encoder button for selecting/entering details
+            if btn_irq.pressed():
                 if view_mode == "list":
                     if history_data:
                         # Enter details mode for first entry on current page
@@ -424,35 +552,22 @@ def run(exit_button=None, display=None, enc=None):
                 elif view_mode == "details":
                     # Go back to list view
                     view_mode = "list"
-                
-                # Wait for button release
-                while not btn.value():
-                    # Check exit button even while waiting for button release
-                    if not exit_btn.value():
-                        utime.sleep_ms(50)
-                        if not exit_btn.value():
-                            # Clear encoder FIFO when exiting
-                            if encoder and encoder.fifo.has_data():
-                                print("Clearing encoder FIFO on nested exit...")
-                                while encoder.fifo.has_data():
-                                    encoder.fifo.get()
-                            
-                            if oled:
-                                show_text_on_oled(["Exiting..."])
-                            print("Exiting HRV History")
-                            return
-                    utime.sleep_ms(10)
-        
-        utime.sleep_ms(10)
+            
+            utime.sleep_ms(10)
+    finally:
+        # Also on an exception, so no handler is left on the menu's pins
+        detach_button_irqs()
 
 # ----------------- EXTERNAL API -----------------
-def add_analysis_to_history(analysis_data):
+def add_analysis_to_history(analysis_data, timestamp=None):
     """External function to add analysis data to history"""
-    print("HRVHistory: add_analysis_to_history called")
-    if analysis_data:
-        print("HRVHistory: Got analysis data with keys:", list(analysis_data.keys()))
-    result = add_history_entry(analysis_data)
-    print("HRVHistory: add_history_entry returned:", result)
+    if DEBUG:
+        print("HRVHistory: add_analysis_to_history called")
+        if analysis_data:
+            print("HRVHistory: Got analysis data with keys:", list(analysis_data.keys()))
+    result = add_history_entry(analysis_data, timestamp)
+    if DEBUG:
+        print("HRVHistory: add_history_entry returned:", result)
     return result
 
 def test_file_creation():
@@ -480,7 +595,7 @@ def test_file_creation():
 def get_history_count():
     """Get number of history entries"""
     try:
-        load_history()
+        ensure_history_loaded()
         return len(history_data)
     except:
         return 0
@@ -2,89 +2,172 @@
 
 import machine
 import utime
-try:
-    import ssd1306
-except:
-    ssd1306 = None
+import array
+import micropython
+from micropython import const
 
 from piotimer import Piotimer
 from fifo import Fifo
+import oled_util
+from oled_util import show_text as show_text_on_oled
 
 # ----------------- CONFIG -----------------
 SAMPLE_HZ = 250
 FIFO_SIZE = 500
 ADC_PIN = 26
-I2C_SCL = 15
-I2C_SDA = 14
-OLED_ENABLED = ssd1306 is not None
-OLED_WIDTH = 128
-OLED_HEIGHT = 64
 EXIT_PIN = 7
-AVG_WINDOW = 20
+AVG_WINDOW = 16  # Power of two so the average is a shift
+AVG_SHIFT = 4    # log2(AVG_WINDOW)
 HRV_WINDOW_BEATS = 120
 MIN_BEATS_TO_CALC = 20
 MID = 32768
+DEBUG = const(0)  # Set to 1 for per-beat logging, 0 compiles the debug prints out
 
 # ----------------- HARDWARE -----------------
-if OLED_ENABLED:
-    try:
-        i2c = machine.I2C(1, scl=machine.Pin(I2C_SCL),
-                          sda=machine.Pin(I2C_SDA), freq=400000)
-        oled = ssd1306.SSD1306_I2C(OLED_WIDTH, OLED_HEIGHT, i2c)
-    except:
-        oled = None
-        print("OLED initialization failed")
-else:
-    oled = None
-
+oled = None  # Shared display from oled_util, set up in run()
 exit_btn = machine.Pin(EXIT_PIN, machine.Pin.IN, machine.Pin.PULL_UP)
 adc = machine.ADC(machine.Pin(ADC_PIN))
 
 # ----------------- FIFO -----------------
 samples = Fifo(FIFO_SIZE)
-ave_fifo = Fifo(AVG_WINDOW + 1)
-for _ in range(AVG_WINDOW):
-    try:
-        ave_fifo.put(MID)
-    except RuntimeError:
-        pass
 
+# Rolling average window, avg_idx points at the oldest sample
+avg_buf = array.array('H', [MID] * AVG_WINDOW)
+avg_idx = 0
 rolling_sum = MID * AVG_WINDOW
-history = []
 max_hist = 400
 low_val = MID
 high_val = MID
-last_beat_ms = utime.ticks_ms()
+
+# Threshold window: ring of recent averages plus monotonic queues of slot
+# positions whose values are increasing (min_q) / decreasing (max_q)
+hist_buf = array.array('H', [0] * max_hist)
+hist_pos = 0
+hist_len = 0
+min_q = array.array('H', [0] * max_hist)
+min_head = 0
+min_len = 0
+max_q = array.array('H', [0] * max_hist)
+max_head = 0
+max_len = 0
+sample_count = 0  # Samples processed, used as the beat timing clock
+last_beat_sample = 0
+SAMPLE_MS = 1000 / SAMPLE_HZ
 beat_flag = False
-rr_intervals = []
+
+# RR intervals in a fixed-size ring buffer, oldest at rr_head once full
+rr_buf = array.array('H', [0] * HRV_WINDOW_BEATS)
+rr_head = 0
+rr_count = 0
 
 # ----------------- SAMPLER -----------------
+@micropython.native
 def sampler_irq(tid):
     try:
-        val = adc.read_u16()
-        if (samples.head + 1) % samples.size != samples.tail:
-            samples.put(val)
+        samples.put(adc.read_u16())
     except:
+        # FIFO full - drop this sample
         pass
 
+# ----------------- RR BUFFER -----------------
+def add_rr_interval(ibi):
+    """Store one RR interval, overwriting the oldest when the buffer is full"""
+    global rr_head, rr_count
+    rr_buf[rr_head] = ibi
+    rr_head = (rr_head + 1) % HRV_WINDOW_BEATS
+    if rr_count < HRV_WINDOW_BEATS:
+        rr_count += 1
+
+def rr_ordered():
+    """Return stored RR intervals in chronological order"""
+    if rr_count < HRV_WINDOW_BEATS:
+        return rr_buf[:rr_count]
+    return rr_buf[rr_head:] + rr_buf[:rr_head]
+
+@micropython.native
+def rr_list_from(skip):
+    """Chronological RR intervals as a list, dropping the first skip, read straight from the ring"""
+    start = rr_head if rr_count == HRV_WINDOW_BEATS else 0
+    out = []
+    for i in range(skip, rr_count):
+        j = start + i
+        if j >= HRV_WINDOW_BEATS:
+            j -= HRV_WINDOW_BEATS
+        out.append(rr_buf[j])
+    return out
+
+# ----------------- THRESHOLD WINDOW -----------------
+def push_history(val):
+    """Add a sample to the threshold window and update low_val/high_val in amortized O(1)"""
+    global hist_pos, hist_len, min_head, min_len, max_head, max_len, low_val, high_val
+    pos = hist_pos
+    # The sample in this slot leaves the window, drop it from the queue fronts
+    if hist_len == max_hist:
+        if min_len and min_q[min_head] == pos:
+            min_head = (min_head + 1) % max_hist
+            min_len -= 1
+        if max_len and max_q[max_head] == pos:
+            max_head = (max_head + 1) % max_hist
+            max_len -= 1
+    else:
+        hist_len += 1
+    hist_buf[pos] = val
+
+    # Drop queued samples that can no longer be the window min/max
+    while min_len and hist_buf[min_q[(min_head + min_len - 1) % max_hist]] >= val:
+        min_len -= 1
+    min_q[(min_head + min_len) % max_hist] = pos
+    min_len += 1
+    while max_len and hist_buf[max_q[(max_head + max_len - 1) % max_hist]] <= val:
+        max_len -= 1
+    max_q[(max_head + max_len) % max_hist] = pos
+    max_len += 1
+
+    hist_pos = (pos + 1) % max_hist
+    low_val = hist_buf[min_q[min_head]]
+    high_val = hist_buf[max_q[max_head]]
+
 # ----------------- HRV CALCULATIONS -----------------
+@micropython.native
 def compute_hrv_metrics(rr_ms):
     n = len(rr_ms)
     if n == 0:
         return None
     
-    mean_rr = sum(rr_ms) / n
-    var = sum((x - mean_rr) ** 2 for x in rr_ms) / n
-    sdnn = var ** 0.5
+    # Single pass: sums for mean/SDNN and successive differences for RMSSD/pNNx.
+    # Sums are taken about the first interval so total_sq stays small and the
+    # variance doesn't cancel away in 32-bit floats
+    base = rr_ms[0]
+    total = 0
+    total_sq = 0
+    diff_sq = 0
+    c50 = 0
+    c20 = 0
+    prev = base
+    for i in range(n):
+        x = rr_ms[i]
+        dx = x - base
+        total += dx
+        total_sq += dx * dx
+        if i:
+            d = x - prev
+            diff_sq += d * d
+            # Branchless counts: comparisons are 0/1 ints
+            ad = d if d >= 0 else -d
+            c50 += ad > 50
+            c20 += ad > 20
+        prev = x
+    
+    mean_rr = base + total / n
+    var = (total_sq - total * total / n) / n
+    sdnn = var ** 0.5 if var > 0 else 0.0
     
     if n < 2:
         rmssd = pnn50 = pnn20 = 0.0
     else:
-        diffs = [rr_ms[i] - rr_ms[i-1] for i in range(1, n)]
-        diffs_sq = [d**2 for d in diffs]
-        rmssd = (sum(diffs_sq)/(n-1))**0.5
-        pnn50 = 100.0 * sum(abs(d)>50 for d in diffs)/(n-1)
-        pnn20 = 100.0 * sum(abs(d)>20 for d in diffs)/(n-1)
+        rmssd = (diff_sq / (n-1)) ** 0.5
+        pnn50 = 100.0 * c50 / (n-1)
+        pnn20 = 100.0 * c20 / (n-1)
     
     mean_hr = 60000.0 / mean_rr if mean_rr > 0 else 0.0
     
@@ -98,28 +181,19 @@ def compute_hrv_metrics(rr_ms):
         "count": n
     }
 
-# ----------------- DISPLAY -----------------
-def show_text_on_oled(lines):
-    if oled is None:
-        return
-    oled.fill(0)
-    y = 0
-    for line in lines:
-        oled.text(str(line), 0, y)
-        y += 10
-        if y > OLED_HEIGHT-10:
-            break
-    oled.show()
-
 # ----------------- MAIN FUNCTION -----------------
 def run(exit_button=None, display=None, enc=None):
-    global rolling_sum, low_val, high_val, last_beat_ms, beat_flag, oled, exit_btn, rr_intervals
+    global rolling_sum, avg_idx, low_val, high_val, sample_count, last_beat_sample, beat_flag, oled, exit_btn
 
     # Use passed parameters if available
     if exit_button is not None:
         exit_btn = exit_button
     if display is not None:
-        oled = display
+        oled = oled_util.set_display(display)
+    else:
+        oled = oled_util.init_oled()
+    # The display may have been drawn by someone else since our last frame
+    oled_util.invalidate()
 
     tmr = Piotimer(Piotimer.PERIODIC, freq=SAMPLE_HZ, callback=sampler_irq)
 
@@ -138,104 +212,88 @@ def run(exit_button=None, display=None, enc=None):
                 print("Exiting HRV Monitor")
                 return
 
-        # Process samples
-        latest = None
+        # Process every queued sample, update the display at most once per pass
+        screen = None
         while samples.has_data():
-            val = samples.get()
-            if val is not None:
-                latest = val
-        if latest is None:
-            continue
-        raw = latest
+            raw = samples.get()
+            sample_count += 1
 
-        # Rolling average
-        oldest = ave_fifo.get() if ave_fifo.has_data() else MID
-        rolling_sum -= oldest
-        try:
-            ave_fifo.put(raw)
-        except RuntimeError:
-            pass
-        rolling_sum += raw
-        avg = rolling_sum / AVG_WINDOW
+            # Rolling average
+            oldest = avg_buf[avg_idx]
+            avg_buf[avg_idx] = raw
+            avg_idx = (avg_idx + 1) & (AVG_WINDOW - 1)
+            rolling_sum += raw - oldest
+            avg = rolling_sum >> AVG_SHIFT
 
-        # Adaptive threshold
-        history.append(avg)
-        if avg < low_val:
-            low_val = avg
-        if avg > high_val:
-            high_val = avg
-        if len(history) > max_hist:
-            removed = history.pop(0)
-            if removed == low_val or removed == high_val:
-                low_val = min(history)
-                high_val = max(history)
-        if len(history) < 30:
-            continue
+            # Adaptive threshold
+            push_history(avg)
+            if hist_len < 30:
+                continue
 
-        thresh_on = (low_val + high_val*3) / 4
-        thresh_off = (low_val + high_val) / 2
+            # Integer thresholds: sum first, then divide by 4 / 2 with shifts
+            thresh_on = (low_val + high_val*3) >> 2
+            thresh_off = (low_val + high_val) >> 1
 
-        # Beat detection
-        if not beat_flag and avg > thresh_on:
-            beat_flag = True
-            now_ms = utime.ticks_ms()
-            ibi = utime.ticks_diff(now_ms, last_beat_ms)
-            last_beat_ms = now_ms
-            
-            if 250 < ibi < 2000:
-                rr_intervals.append(ibi)
-                if len(rr_intervals) > HRV_WINDOW_BEATS:
-                    rr_intervals.pop(0)
+            # Beat detection, timed by sample position rather than loop wall clock
+            if not beat_flag and avg > thresh_on:
+                beat_flag = True
+                ibi = round((sample_count - last_beat_sample) * SAMPLE_MS)
+                last_beat_sample = sample_count
                 
-                bpm = round(60000 / ibi)
-                
-                if len(rr_intervals) >= MIN_BEATS_TO_CALC:
-                    # Calculate and display HRV metrics
-                    hrv = compute_hrv_metrics(rr_intervals)
-                    clean_beats = len(rr_intervals) - MIN_BEATS_TO_CALC
+                if 250 < ibi < 2000:
+                    add_rr_interval(ibi)
                     
-                    print("HRV: HR=%.1f SDNN=%.2f RMSSD=%.2f pNN50=%.1f%% (Total: %d, Clean: %d)" %
-                          (hrv["mean_hr_bpm"], hrv["sdnn_ms"], 
-                           hrv["rmssd_ms"], hrv["pnn50_percent"], 
-                           len(rr_intervals), clean_beats))
+                    bpm = round(60000 / ibi)
                     
-                    if clean_beats >= 10:
-                        # Enough clean data for Kubios
-                        if oled:
-                            show_text_on_oled([
+                    if rr_count >= MIN_BEATS_TO_CALC:
+                        # Calculate and display HRV metrics
+                        hrv = compute_hrv_metrics(rr_ordered())
+                        clean_beats = rr_count - MIN_BEATS_TO_CALC
+                        
+                        if DEBUG:
+                            print("HRV: HR=%.1f SDNN=%.2f RMSSD=%.2f pNN50=%.1f%% (Total: %d, Clean: %d)" %
+                                  (hrv["mean_hr_bpm"], hrv["sdnn_ms"], 
+                                   hrv["rmssd_ms"], hrv["pnn50_percent"], 
+                                   rr_count, clean_beats))
+                        
+                        if clean_beats >= 10:
+                            # Enough clean data for Kubios
+                            screen = [
                                 "HRV READY!",
                                 "HR: %.0f bpm" % hrv["mean_hr_bpm"],
                                 "SDNN: %.1f ms" % hrv["sdnn_ms"],
                                 "RMSSD: %.1f ms" % hrv["rmssd_ms"],
                                 "Clean beats: %d" % clean_beats,
                                 "Ready for Kubios!"
-                            ])
-                    else:
-                        # Still need more clean data
-                        if oled:
-                            show_text_on_oled([
+                            ]
+                        else:
+                            # Still need more clean data
+                            screen = [
                                 "HRV ANALYSIS",
                                 "HR: %.0f bpm" % hrv["mean_hr_bpm"],
                                 "SDNN: %.1f ms" % hrv["sdnn_ms"],
                                 "RMSSD: %.1f ms" % hrv["rmssd_ms"],
                                 "Clean: %d/10" % clean_beats,
                                 "Collecting..."
-                            ])
-                else:
-                    # Still collecting data
-                    if oled:
-                        show_text_on_oled([
+                            ]
+                    else:
+                        # Still collecting data
+                        screen = [
                             "HRV MONITOR",
                             "Hold finger...",
                             "Collecting data:",
-                            "Beats: %d/%d" % (len(rr_intervals), MIN_BEATS_TO_CALC),
+                            "Beats: %d/%d" % (rr_count, MIN_BEATS_TO_CALC),
                             "Last BPM: %d" % bpm
-                        ])
-                    print("Collecting: %d/%d beats, BPM: %d" % 
-                          (len(rr_intervals), MIN_BEATS_TO_CALC, bpm))
-                    
-        if beat_flag and avg < thresh_off:
-            beat_flag = False
+                        ]
+                        if DEBUG:
+                            print("Collecting: %d/%d beats, BPM: %d" % 
+                                  (rr_count, MIN_BEATS_TO_CALC, bpm))
+                        
+            if beat_flag and avg < thresh_off:
+                beat_flag = False
+
+        if screen and oled:
+            show_text_on_oled(screen)
 
 # ----------------- DATA ACCESS -----------------
 def get_rr_intervals():
@@ -244,25 +302,25 @@ def get_rr_intervals():
     Returns only the RR intervals after the initial MIN_BEATS_TO_CALC period,
     excluding the first 20 beats used for HRV calculation setup.
     """
-    if len(rr_intervals) > MIN_BEATS_TO_CALC:
+    if rr_count > MIN_BEATS_TO_CALC:
         # Return only the clean data after initial calculation period
-        clean_data = rr_intervals[MIN_BEATS_TO_CALC:]
+        clean_data = rr_list_from(MIN_BEATS_TO_CALC)
         print("Returning %d clean RR intervals (excluding first %d setup beats)" % 
               (len(clean_data), MIN_BEATS_TO_CALC))
-        return clean_data.copy()
+        return clean_data
     else:
-        print("Not enough data for clean intervals (%d/%d)" % (len(rr_intervals), MIN_BEATS_TO_CALC))
+        print("Not enough data for clean intervals (%d/%d)" % (rr_count, MIN_BEATS_TO_CALC))
         return []
 
 def get_hrv_status():
     """Get current HRV collection status"""
-    clean_beats = max(0, len(rr_intervals) - MIN_BEATS_TO_CALC)
+    clean_beats = max(0, rr_count - MIN_BEATS_TO_CALC)
     return {
-        "total_beats": len(rr_intervals),
+        "total_beats": rr_count,
         "clean_beats": clean_beats,
-        "ready_for_analysis": len(rr_intervals) >= MIN_BEATS_TO_CALC,
+        "ready_for_analysis": rr_count >= MIN_BEATS_TO_CALC,
         "ready_for_kubios": clean_beats >= 10,  # Need at least 10 clean beats for Kubios
-        "last_bpm": 60000 // rr_intervals[-1] if rr_intervals else 0
+        "last_bpm": 60000 // rr_buf[rr_head - 1] if rr_count else 0
     }
 
 # Menu compatibility
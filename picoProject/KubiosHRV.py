@@ -2,25 +2,24 @@
 
 import machine
 import utime
-import network
 import ujson
-try:
-    import ssd1306
-except:
-    ssd1306 = None
+import select
+from micropython import const
+import oled_util
+from oled_util import show_text as show_text_on_oled
+import time_util
+import button_util
 try:
     from umqtt.simple import MQTTClient
 except:
     MQTTClient = None
 
 # ----------------- CONFIG -----------------
-I2C_SCL = 15
-I2C_SDA = 14
-OLED_ENABLED = ssd1306 is not None
-OLED_WIDTH = 128
-OLED_HEIGHT = 64
+OLED_WIDTH = oled_util.OLED_WIDTH
+OLED_HEIGHT = oled_util.OLED_HEIGHT
 EXIT_PIN = 7
 NAV_PIN = 10
+IDLE_MS = 50  # Main loop poll period, presses are latched and debounced in the IRQ
 
 # MQTT/Kubios config
 SSID = "KME759_Group_10"
@@ -33,28 +32,72 @@ DEVICE_MAC = "28CDC1057762" # Remember to change to individual PICO Mac Address!
 DEVICE_NAME = "Pico HRV Monitor"
 PATIENT_NAME = "HRV User"
 PATIENT_ID = 1  # Default patient ID - update as needed
-
-
+RESPONSE_TIMEOUT_MS = 15000  # How long to wait for a Kubios analysis
+REG_FILE = ".kubios_reg"  # Remembers the MAC:PATIENT_ID already registered
+DEBUG_TIME = const(0)  # Set to 1 to log timestamps as dates, 0 compiles the formatting out
+
+
+# ----------------- SCREENS -----------------
+# Static status screens, built once instead of on every refresh
+_SCR_REGISTERING_DEVICE = ("REGISTERING", "DEVICE...", "", "Please wait")
+_SCR_REGISTERING_PATIENT = ("REGISTERING", "PATIENT...", "", "Please wait")
+_SCR_SAVING = ("SAVING...", "", "Database & History", "Please wait")
+_SCR_SAVED_BOTH = ("ANALYSIS COMPLETE!", "Saved to database", "& local history", "Press Nav to view")
+_SCR_SAVED_DB_ONLY = ("ANALYSIS SAVED", "Database: OK", "History: failed", "Press Nav to view")
+_SCR_SAVED_HISTORY_ONLY = ("ANALYSIS SAVED", "Database: failed", "History: OK", "Press Nav to view")
+_SCR_SAVE_FAILED = ("ANALYSIS RECEIVED", "Save failed", "", "Press Nav to view")
+_SCR_RESPONSE_ERROR = ("RESPONSE ERROR", "Check format", "", "See console")
+_SCR_REGISTRATION_FAILED = ("REGISTRATION", "FAILED", "", "Check connection")
+_SCR_WAITING = ("WAITING FOR", "KUBIOS...", "", "Exit: cancel")
+_SCR_NO_RESPONSE = ("NO RESPONSE", "FROM KUBIOS", "", "Check server")
+_SCR_READY = ("KUBIOS HRV", "Ready", "", "Nav: send test", "Exit: return")
+_SCR_EXITING = ("Exiting...",)
+_SCR_CONNECTING = ("CONNECTING...", "", "Exit: cancel", "Please wait...")
+_SCR_NO_CLEAN_DATA = ("NO CLEAN DATA", "Need 30+ total beats", "in HRVMonitor", "Using test data...")
+_SCR_MQTT_FAILED = ("MQTT failed", "", "Check settings")
+_SCR_WIFI_FAILED = ("WiFi failed", "", "Check network")
 
 # ----------------- HARDWARE -----------------
-if OLED_ENABLED:
-    try:
-        i2c = machine.I2C(1, scl=machine.Pin(I2C_SCL),
-                          sda=machine.Pin(I2C_SDA), freq=400000)
-        oled = ssd1306.SSD1306_I2C(OLED_WIDTH, OLED_HEIGHT, i2c)
-    except:
-        oled = None
-        print("OLED initialization failed")
-else:
-    oled = None
+oled = oled_util.init_oled()  # Shared display, not a second SSD1306 init
 
 exit_btn = machine.Pin(EXIT_PIN, machine.Pin.IN, machine.Pin.PULL_UP)
 nav_btn = machine.Pin(NAV_PIN, machine.Pin.IN, machine.Pin.PULL_UP)
 
+# ----- BUTTONS USING INTERRUPT + EDGE LATCH -----
+exit_button_irq = button_util.Button(exit_btn)  # Rebuilt in run() for the menu's exit button
+nav_button_irq = button_util.Button(nav_btn)
+
+def attach_button_irqs(enc=None):
+    """Latch button presses from falling edges instead of polling the pins"""
+    exit_button_irq.attach()
+    # With the menu's encoder NAV_PIN already carries its IRQ, nav comes from the encoder FIFO
+    if enc is None:
+        nav_button_irq.attach()
+
+def detach_button_irqs(enc=None):
+    """Release button interrupts when leaving, the pins are shared with the menu"""
+    exit_button_irq.detach()
+    if enc is None:
+        nav_button_irq.detach()
+
+def nav_pressed(enc=None):
+    """Consume a pending nav press, True if there was one"""
+    if enc is not None:
+        if not enc.fifo.has_data():
+            return False
+        while enc.fifo.has_data():
+            enc.fifo.get()
+        return True
+    return nav_button_irq.pressed()
 
+def exit_pressed():
+    """Consume a pending exit press, True if there was one"""
+    return exit_button_irq.pressed()
 
 # ----------------- GLOBALS -----------------
 mqtt_client = None
+mqtt_poller = None  # select.poll on the MQTT socket, wakes as soon as data arrives
+_net = None  # network module, imported by _network() on first use
 wifi_connected = False
 last_analysis = None
 display_page = 0
@@ -67,7 +110,7 @@ patient_registered = False
 
 def reset_connections():
     """Reset all connection states for clean startup"""
-    global mqtt_client, wifi_connected, last_analysis, connection_attempted
+    global mqtt_client, mqtt_poller, wifi_connected, last_analysis, connection_attempted
     global device_registered, patient_registered
     
     # Disconnect MQTT if connected
@@ -77,25 +120,35 @@ def reset_connections():
         except:
             pass
         mqtt_client = None
+        mqtt_poller = None
     
-    # Reset WiFi
-    try:
-        wlan = network.WLAN(network.STA_IF)
-        if wlan.isconnected():
-            wlan.disconnect()
-        wlan.active(False)
-        utime.sleep_ms(100)
-        wlan.active(True)
-    except:
-        pass
+    # Reset WiFi, nothing to reset if this session never brought it up
+    if _net is not None:
+        try:
+            wlan = _net.WLAN(_net.STA_IF)
+            if wlan.isconnected():
+                wlan.disconnect()
+            wlan.active(False)
+            utime.sleep_ms(100)
+            wlan.active(True)
+        except:
+            pass
     
     wifi_connected = False
     last_analysis = None
     connection_attempted = False
-    device_registered = False
-    patient_registered = False
+    # Registrations survive reboots, only redo them if MAC or patient changed
+    device_registered = patient_registered = registration_saved()
     print("Connections reset")
 
+def _network():
+    """Import the network module on first WiFi use, it is slow to load"""
+    global _net
+    if _net is None:
+        import network
+        _net = network
+    return _net
+
 # ----------------- HRV DATA ACCESS -----------------
 def get_hrv_data():
     """Get clean RR intervals from HRVMonitor.py (excluding initial setup beats)"""
@@ -120,6 +173,25 @@ def get_hrv_data():
         return None
 
 # ----------------- REGISTRATION FUNCTIONS -----------------
+def _registration_key():
+    return DEVICE_MAC + ":" + str(PATIENT_ID)
+
+def registration_saved():
+    """True if this device and patient were registered on an earlier boot"""
+    try:
+        with open(REG_FILE, "r") as f:
+            return f.read().strip() == _registration_key()
+    except:
+        return False
+
+def save_registration():
+    """Remember the registration in flash so later boots can skip it"""
+    try:
+        with open(REG_FILE, "w") as f:
+            f.write(_registration_key())
+    except Exception as e:
+        print("Could not save registration flag:", e)
+
 def register_device():
     """Register device with Kubios database (one-time per session)"""
     global mqtt_client
@@ -128,12 +200,10 @@ def register_device():
         return False
     
     try:
-        payload = (
-            "{"
-            '"mac": "' + DEVICE_MAC + '",'
-            '"device_name": "' + DEVICE_NAME + '"'
-            "}"
-        )
+        payload = ujson.dumps({
+            "mac": DEVICE_MAC,
+            "device_name": DEVICE_NAME
+        }).encode()
         
         print("Registering device (one-time):", payload)
         mqtt_client.publish(b"database/devices/add", payload)
@@ -152,12 +222,10 @@ def register_patient():
         return False
     
     try:
-        payload = (
-            "{"
-            '"mac": "' + DEVICE_MAC + '",'
-            '"patient_name": "' + PATIENT_NAME + '"'
-            "}"
-        )
+        payload = ujson.dumps({
+            "mac": DEVICE_MAC,
+            "patient_name": PATIENT_NAME
+        }).encode()
         
         print("Registering patient (one-time):", payload)
         mqtt_client.publish(b"database/patients/add", payload)
@@ -172,86 +240,40 @@ def ensure_registrations():
     """Ensure device and patient are registered before sending HRV data"""
     global device_registered, patient_registered
     
-    # Only register if not already done in this session
+    # Only register if not already done (this session or a saved earlier one)
+    registered_device_now = False
     if not device_registered:
         if oled:
-            show_text_on_oled([
-                "REGISTERING",
-                "DEVICE...",
-                "",
-                "Please wait"
-            ])
+            show_text_on_oled(_SCR_REGISTERING_DEVICE)
         if register_device():
             device_registered = True
+            registered_device_now = True
             print("Device registration completed for this session")
         else:
             return False
-        utime.sleep_ms(500)  # Brief pause
+        # No pause here, the patient publish follows on the same TCP stream
     else:
         print("Device already registered this session")
     
     if not patient_registered:
-        if oled:
-            show_text_on_oled([
-                "REGISTERING", 
-                "PATIENT...",
-                "",
-                "Please wait"
-            ])
+        if oled and registered_device_now:
+            # Device screen is still up, only the second row changes
+            show_text_on_oled_partial(["PATIENT..."], 1)
+        elif oled:
+            show_text_on_oled(_SCR_REGISTERING_PATIENT)
         if register_patient():
             patient_registered = True
             print("Patient registration completed for this session")
+            save_registration()
         else:
             return False
-        utime.sleep_ms(500)  # Brief pause
+        utime.sleep_ms(500)  # Let the server store both before the first record
     else:
         print("Patient already registered this session")
     
     return True
 
-def get_real_timestamp():
-    """Get real Unix timestamp by syncing with network time"""
-    try:
-        import ntptime
-        # Sync with NTP server to get real time
-        print("Syncing time with NTP server...")
-        ntptime.settime()
-        # After ntptime.settime(), utime.time() returns Unix timestamp directly
-        timestamp = utime.time()
-        
-        # Show human-readable time
-        try:
-            time_tuple = utime.localtime(timestamp)
-            time_str = "%04d-%02d-%02d %02d:%02d:%02d UTC" % (
-                time_tuple[0], time_tuple[1], time_tuple[2], 
-                time_tuple[3], time_tuple[4], time_tuple[5]
-            )
-            print("Time synced successfully: %s" % time_str)
-        except:
-            print("Time synced, timestamp:", timestamp)
-        
-        return timestamp
-    except Exception as e:
-        print("NTP sync failed, using approximate time:", e)
-        # Fallback: use approximate current time (December 4, 2025)
-        # Current Unix timestamp for Dec 4, 2025 8:35 UTC is approximately 1764835350
-        base_time = 1764835350  # Dec 4, 2025 8:35 UTC 
-        device_uptime_offset = utime.ticks_ms() // 1000  # Convert ms to seconds
-        approximate_time = base_time + device_uptime_offset
-        
-        try:
-            time_tuple = utime.localtime(approximate_time)
-            time_str = "%04d-%02d-%02d %02d:%02d:%02d (approx)" % (
-                time_tuple[0], time_tuple[1], time_tuple[2], 
-                time_tuple[3], time_tuple[4], time_tuple[5]
-            )
-            print("Using approximate time: %s" % time_str)
-        except:
-            print("Using approximate timestamp:", approximate_time)
-        
-        return approximate_time
-
-def add_record_to_database(analysis_data):
+def add_record_to_database(analysis_data, timestamp):
     """Add HRV analysis record to Kubios database"""
     global mqtt_client
     
@@ -259,9 +281,6 @@ def add_record_to_database(analysis_data):
         return False
     
     try:
-        # Get real current timestamp
-        timestamp = get_real_timestamp()
-        
         # Extract data from Kubios analysis
         mean_hr = analysis_data.get('mean_hr_bpm', 0)
         mean_ppi = analysis_data.get('mean_rr_ms', 0)  # PPI is same as RR interval
@@ -270,32 +289,33 @@ def add_record_to_database(analysis_data):
         sns = analysis_data.get('sns_index', 0)
         pns = analysis_data.get('pns_index', 0)
         
-        payload = (
-            "{"
-            '"mac": "' + DEVICE_MAC + '",'
-            '"timestamp": ' + str(timestamp) + ','
-            '"mean_hr": ' + str(mean_hr) + ','
-            '"mean_ppi": ' + str(mean_ppi) + ','
-            '"rmssd": ' + str(rmssd) + ','
-            '"sdnn": ' + str(sdnn) + ','
-            '"sns": ' + str(sns) + ','
-            '"pns": ' + str(pns) + ','
-            '"patient_id": ' + str(PATIENT_ID) +
-            "}"
-        )
+        payload = ujson.dumps({
+            "mac": DEVICE_MAC,
+            "timestamp": timestamp,
+            "mean_hr": mean_hr,
+            "mean_ppi": mean_ppi,
+            "rmssd": rmssd,
+            "sdnn": sdnn,
+            "sns": sns,
+            "pns": pns,
+            "patient_id": PATIENT_ID
+        }).encode()
         
-        # Show human-readable time for verification
-        try:
-            time_tuple = utime.localtime(timestamp)
-            time_str = "%04d-%02d-%02d %02d:%02d:%02d" % (
-                time_tuple[0], time_tuple[1], time_tuple[2], 
-                time_tuple[3], time_tuple[4], time_tuple[5]
-            )
-            print("Record timestamp: %s (%d)" % (time_str, timestamp))
-        except:
+        # Show human-readable time for verification when debugging
+        if DEBUG_TIME:
+            try:
+                time_tuple = utime.localtime(timestamp)
+                time_str = "%04d-%02d-%02d %02d:%02d:%02d" % (
+                    time_tuple[0], time_tuple[1], time_tuple[2], 
+                    time_tuple[3], time_tuple[4], time_tuple[5]
+                )
+                print("Record timestamp: %s (%d)" % (time_str, timestamp))
+            except:
+                print("Record timestamp: %d" % timestamp)
+        else:
             print("Record timestamp: %d" % timestamp)
         
-        print("Adding record to database:", payload[:100] + "..." if len(payload) > 100 else payload)
+        print("Adding record to database (%d bytes):" % len(payload), payload[:100])
         mqtt_client.publish(b"database/records/add", payload)
         print("Record added to database")
         return True
@@ -305,17 +325,28 @@ def add_record_to_database(analysis_data):
         return False
 
 # ----------------- DISPLAY -----------------
-def show_text_on_oled(lines):
+def show_text_on_oled_partial(lines, first_line=0):
+    """Redraw text rows starting at first_line and send only the pages they cover"""
     if oled is None:
         return
-    oled.fill(0)
-    y = 0
+    y0 = first_line * 10
+    y1 = min(y0 + len(lines) * 10, OLED_HEIGHT)
+    oled.fill_rect(0, y0, OLED_WIDTH, y1 - y0, 0)
+    y = y0
     for line in lines:
-        oled.text(str(line), 0, y)
-        y += 10
         if y > OLED_HEIGHT-10:
             break
-    oled.show()
+        oled.text(str(line), 0, y)
+        y += 10
+    oled_util.write_pages(y0 // 8, (y1 - 1) // 8)
+    oled_util.invalidate()  # The screen no longer matches show_text's last lines
+
+def _fmt(label, val, ffmt):
+    """Format a metric with ffmt, or as plain text when it isn't a number (e.g. 'N/A')"""
+    try:
+        return label + (ffmt % val)
+    except TypeError:
+        return label + str(val)
 
 def display_analysis_page(analysis, page):
     if oled is None or analysis is None:
@@ -335,10 +366,10 @@ def display_analysis_page(analysis, page):
         
         show_text_on_oled([
             "KUBIOS ANALYSIS",
-            "Score: %.1f" % readiness if isinstance(readiness, (int, float)) else "Score: %s" % readiness,
-            "HR: %.1f bpm" % mean_hr if isinstance(mean_hr, (int, float)) else "HR: %s" % mean_hr,
-            "Stress: %.1f" % stress_index if isinstance(stress_index, (int, float)) else "Stress: %s" % stress_index,
-            "Age: %d years" % phys_age if isinstance(phys_age, (int, float)) else "Age: %s" % phys_age,
+            _fmt("Score: ", readiness, "%.1f"),
+            _fmt("HR: ", mean_hr, "%.1f bpm"),
+            _fmt("Stress: ", stress_index, "%.1f"),
+            _fmt("Age: ", phys_age, "%d years"),
             "SAVED TO DB & HISTORY"
         ])
     
@@ -356,13 +387,15 @@ def connect_wifi():
     if MQTTClient is None:
         return None
     
-    wlan = network.WLAN(network.STA_IF)
+    sleep_ms = utime.sleep_ms  # Local lookup in the connect loop
+    net = _network()
+    wlan = net.WLAN(net.STA_IF)
     wlan.active(True)
     
     # Force disconnect and reconnect for clean connection
     if wlan.isconnected():
         wlan.disconnect()
-        utime.sleep_ms(500)
+        sleep_ms(500)
     
     wlan.connect(SSID, PASSWORD)
     
@@ -370,13 +403,11 @@ def connect_wifi():
     attempts = 200  # 20 seconds
     while not wlan.isconnected() and attempts > 0:
         # Check exit button during connection
-        if not exit_btn.value():
-            utime.sleep_ms(50)
-            if not exit_btn.value():
-                print("Exit pressed during WiFi connection")
-                return "EXIT_REQUESTED"
+        if exit_pressed():
+            print("Exit pressed during WiFi connection")
+            return "EXIT_REQUESTED"
         
-        utime.sleep_ms(100)
+        sleep_ms(100)
         attempts -= 1
     
     if wlan.isconnected():
@@ -388,16 +419,14 @@ def connect_wifi():
         return None
 
 def connect_mqtt():
-    global mqtt_client, exit_btn
+    global mqtt_client, mqtt_poller, exit_btn
     if not wifi_connected or MQTTClient is None:
         return None
     
     # Check exit button before MQTT connection
-    if not exit_btn.value():
-        utime.sleep_ms(50)
-        if not exit_btn.value():
-            print("Exit pressed during MQTT connection")
-            return "EXIT_REQUESTED"
+    if exit_pressed():
+        print("Exit pressed during MQTT connection")
+        return "EXIT_REQUESTED"
     
     try:
         client = MQTTClient(client_id=b"kubios_hrv", server=BROKER_IP, port=BROKER_PORT)
@@ -405,12 +434,22 @@ def connect_mqtt():
         client.set_callback(on_message_received)
         client.connect(clean_session=True)
         client.subscribe(b"kubios/response")
+        mqtt_poller = select.poll()
+        mqtt_poller.register(client.sock, select.POLLIN)
         print("MQTT connected")
         return client
     except Exception as e:
         print("MQTT failed:", e)
         return None
 
+def service_mqtt(timeout_ms=0):
+    """Handle a pending MQTT message, waiting up to timeout_ms for one to arrive"""
+    if mqtt_poller is None:
+        mqtt_client.check_msg()
+    elif mqtt_poller.poll(timeout_ms):
+        # Data is ready: one blocking wait_msg, no setblocking() toggling like check_msg
+        mqtt_client.wait_msg()
+
 def on_message_received(topic, msg):
     global last_analysis, display_page
     try:
@@ -424,70 +463,43 @@ def on_message_received(topic, msg):
             
             # Save to database and local history
             if oled:
-                show_text_on_oled([
-                    "SAVING...",
-                    "",
-                    "Database & History",
-                    "Please wait"
-                ])
+                show_text_on_oled(_SCR_SAVING)
+            
+            # One timestamp for both copies of the record
+            timestamp = time_util.get_timestamp()
             
             # Save to database
-            db_success = add_record_to_database(last_analysis)
+            db_success = add_record_to_database(last_analysis, timestamp)
             
             # Save to local history
             history_success = False
             try:
                 import HRVHistory
-                history_success = HRVHistory.add_analysis_to_history(last_analysis)
+                history_success = HRVHistory.add_analysis_to_history(last_analysis, timestamp)
             except Exception as e:
                 print("History save failed:", e)
             
             # Show result
             if db_success and history_success:
                 if oled:
-                    show_text_on_oled([
-                        "ANALYSIS COMPLETE!",
-                        "Saved to database",
-                        "& local history",
-                        "Press Nav to view"
-                    ])
+                    show_text_on_oled(_SCR_SAVED_BOTH)
                 print("Analysis saved to database and history successfully")
             elif db_success:
                 if oled:
-                    show_text_on_oled([
-                        "ANALYSIS SAVED",
-                        "Database: OK",
-                        "History: failed",
-                        "Press Nav to view"
-                    ])
+                    show_text_on_oled(_SCR_SAVED_DB_ONLY)
                 print("Analysis saved to database, history save failed")
             elif history_success:
                 if oled:
-                    show_text_on_oled([
-                        "ANALYSIS SAVED",
-                        "Database: failed", 
-                        "History: OK",
-                        "Press Nav to view"
-                    ])
+                    show_text_on_oled(_SCR_SAVED_HISTORY_ONLY)
                 print("Analysis saved to history, database save failed")
             else:
                 if oled:
-                    show_text_on_oled([
-                        "ANALYSIS RECEIVED",
-                        "Save failed",
-                        "",
-                        "Press Nav to view"
-                    ])
+                    show_text_on_oled(_SCR_SAVE_FAILED)
                 print("Analysis received but both saves failed")
         else:
             print("Unexpected response format:", response)
             if oled:
-                show_text_on_oled([
-                    "RESPONSE ERROR",
-                    "Check format",
-                    "",
-                    "See console"
-                ])
+                show_text_on_oled(_SCR_RESPONSE_ERROR)
         
     except Exception as e:
         print("Parse error:", e)
@@ -499,6 +511,14 @@ def on_message_received(topic, msg):
                 "Check response"
             ])
 
+def compact_dumps(obj):
+    """JSON without spaces after separators, one byte less per RR value"""
+    try:
+        return ujson.dumps(obj, separators=(",", ":"))
+    except TypeError:
+        # Older firmware without the separators argument
+        return ujson.dumps(obj)
+
 def send_hrv_request(rr_data=None):
     global mqtt_client, last_analysis
     if mqtt_client is None:
@@ -507,12 +527,7 @@ def send_hrv_request(rr_data=None):
     # Ensure device and patient are registered first
     if not ensure_registrations():
         if oled:
-            show_text_on_oled([
-                "REGISTRATION",
-                "FAILED",
-                "",
-                "Check connection"
-            ])
+            show_text_on_oled(_SCR_REGISTRATION_FAILED)
         return False
     
     try:
@@ -526,46 +541,47 @@ def send_hrv_request(rr_data=None):
         else:
             print("Using real RR data:", len(rr_data), "intervals")
         
-        payload = (
-            "{"
-            '"mac": "' + DEVICE_MAC + '",'
-            '"type": "RRI",'
-            '"data": [' + ",".join(str(x) for x in rr_data) + '],'
-            '"analysis": { "type": "readiness" }'
-            "}"
-        )
+        # Publish bytes: umqtt writes them as-is and its length prefix counts bytes
+        payload = compact_dumps({
+            "mac": DEVICE_MAC,
+            "type": "RRI",
+            "data": rr_data,
+            "analysis": {"type": "readiness"}
+        }).encode()
         
         # Clear previous analysis
         last_analysis = None
         
-        print("Sending payload:", payload[:100] + "..." if len(payload) > 100 else payload)
+        print("Sending payload (%d bytes):" % len(payload), payload[:100])
         mqtt_client.publish(b"kubios/request", payload)
         print("HRV request sent to Kubios")
         
         # Wait for response with timeout
         if oled:
-            show_text_on_oled([
-                "WAITING FOR",
-                "KUBIOS...",
-                "",
-                "Exit: cancel"
-            ])
+            show_text_on_oled(_SCR_WAITING)
         
-        # Wait up to 15 seconds for response
-        timeout = 150  # 15 seconds
-        while timeout > 0 and last_analysis is None:
-            if not exit_btn.value():
-                utime.sleep_ms(50)
-                if not exit_btn.value():
-                    return "EXIT_REQUESTED"
+        # Wait up to RESPONSE_TIMEOUT_MS for response, blocking in poll()
+        # until the socket has data (or 100 ms pass to check the exit button)
+        ticks_ms = utime.ticks_ms
+        ticks_diff = utime.ticks_diff
+        deadline = utime.ticks_add(ticks_ms(), RESPONSE_TIMEOUT_MS)
+        shown_s = -1
+        while last_analysis is None:
+            left_ms = ticks_diff(deadline, ticks_ms())
+            if left_ms <= 0:
+                break
+            # Countdown row only, the rest of the screen stays as drawn
+            left_s = (left_ms + 999) // 1000
+            if oled and left_s != shown_s:
+                shown_s = left_s
+                show_text_on_oled_partial(["Timeout: %ds" % left_s], 2)
+            if exit_pressed():
+                return "EXIT_REQUESTED"
             
             try:
-                mqtt_client.check_msg()
+                service_mqtt(100)
             except:
-                pass
-            
-            utime.sleep_ms(100)
-            timeout -= 1
+                utime.sleep_ms(100)
         
         if last_analysis is not None:
             print("Kubios analysis received successfully")
@@ -573,12 +589,7 @@ def send_hrv_request(rr_data=None):
         else:
             print("Kubios response timeout")
             if oled:
-                show_text_on_oled([
-                    "NO RESPONSE",
-                    "FROM KUBIOS",
-                    "",
-                    "Check server"
-                ])
+                show_text_on_oled(_SCR_NO_RESPONSE)
             return False
         
     except Exception as e:
@@ -591,13 +602,14 @@ def send_test_request():
 
 # ----------------- MAIN FUNCTION -----------------
 def run(exit_button=None, display=None, enc=None):
-    global mqtt_client, last_analysis, display_page, oled, exit_btn, connection_attempted
+    global oled, exit_btn, exit_button_irq
 
     # Use passed parameters if available
     if exit_button is not None:
         exit_btn = exit_button
+        exit_button_irq = button_util.Button(exit_btn)
     if display is not None:
-        oled = display
+        oled = oled_util.set_display(display)
 
     print("Kubios HRV Viewer starting")
     
@@ -605,42 +617,55 @@ def run(exit_button=None, display=None, enc=None):
     reset_connections()
     
     if oled:
-        show_text_on_oled(["KUBIOS HRV", "Ready", "", "Nav: send test", "Exit: return"])
+        show_text_on_oled(_SCR_READY)
+
+    # Clear any stale encoder inputs
+    if enc is not None:
+        while enc.fifo.has_data():
+            enc.fifo.get()
+
+    attach_button_irqs(enc)
+    try:
+        main_loop(enc)
+    finally:
+        detach_button_irqs(enc)
+
+def main_loop(enc=None):
+    global mqtt_client, last_analysis, connection_attempted
+    sleep_ms = utime.sleep_ms  # Local lookup for the idle poll
 
     while True:
         # Exit button check
-        if not exit_btn.value():
-            utime.sleep_ms(50)
-            if not exit_btn.value():
-                if last_analysis:
-                    # If showing analysis, clear it and return to main menu
-                    last_analysis = None
-                    if oled:
-                        reg_status = "Ready"
-                        if device_registered and patient_registered:
-                            reg_status = "Registered"
-                        elif device_registered or patient_registered:
-                            reg_status = "Partial reg"
-                        
-                        show_text_on_oled([
-                            "KUBIOS HRV",
-                            reg_status,
-                            "",
-                            "Nav: send HRV data",
-                            "Exit: return"
-                        ])
-                    print("Cleared analysis, back to main menu")
-                else:
-                    # Exit the program
-                    if oled:
-                        show_text_on_oled(["Exiting..."])
-                    print("Exiting Kubios HRV")
-                    if mqtt_client:
-                        try:
-                            mqtt_client.disconnect()
-                        except:
-                            pass
-                    return
+        if exit_pressed():
+            if last_analysis:
+                # If showing analysis, clear it and return to main menu
+                last_analysis = None
+                if oled:
+                    reg_status = "Ready"
+                    if device_registered and patient_registered:
+                        reg_status = "Registered"
+                    elif device_registered or patient_registered:
+                        reg_status = "Partial reg"
+                    
+                    show_text_on_oled([
+                        "KUBIOS HRV",
+                        reg_status,
+                        "",
+                        "Nav: send HRV data",
+                        "Exit: return"
+                    ])
+                print("Cleared analysis, back to main menu")
+            else:
+                # Exit the program
+                if oled:
+                    show_text_on_oled(_SCR_EXITING)
+                print("Exiting Kubios HRV")
+                if mqtt_client:
+                    try:
+                        mqtt_client.disconnect()
+                    except:
+                        pass
+                return
 
         # Connection status display (no actual connection attempts in main loop)
         if not connection_attempted:
@@ -663,108 +688,74 @@ def run(exit_button=None, display=None, enc=None):
         # Check for MQTT messages
         if mqtt_client:
             try:
-                mqtt_client.check_msg()
+                service_mqtt()
             except:
                 pass
 
         # Navigation button
-        if not nav_btn.value():
-            utime.sleep_ms(50)
-            if not nav_btn.value():
-                if last_analysis:
-                    # Show analysis (single page now)
-                    display_analysis_page(last_analysis, 0)
-                else:
-                    # Try to get HRV data and send to Kubios
+        if nav_pressed(enc):
+            if last_analysis:
+                # Show analysis (single page now)
+                display_analysis_page(last_analysis, 0)
+            else:
+                # Try to get HRV data and send to Kubios
+                if oled:
+                    show_text_on_oled(_SCR_CONNECTING)
+                
+                # Connection attempt with exit check
+                wlan = connect_wifi()
+                if wlan == "EXIT_REQUESTED":
+                    # User pressed exit during connection
                     if oled:
-                        show_text_on_oled([
-                            "CONNECTING...",
-                            "",
-                            "Exit: cancel",
-                            "Please wait..."
-                        ])
-                    
-                    # Connection attempt with exit check
-                    wlan = connect_wifi()
-                    if wlan == "EXIT_REQUESTED":
-                        # User pressed exit during connection
+                        show_text_on_oled(_SCR_EXITING)
+                    print("Exiting Kubios HRV")
+                    return
+                elif wlan:
+                    mqtt_client = connect_mqtt()
+                    if mqtt_client == "EXIT_REQUESTED":
+                        # User pressed exit during MQTT connection
                         if oled:
-                            show_text_on_oled(["Exiting..."])
+                            show_text_on_oled(_SCR_EXITING)
                         print("Exiting Kubios HRV")
                         return
-                    elif wlan:
-                        mqtt_client = connect_mqtt()
-                        if mqtt_client == "EXIT_REQUESTED":
-                            # User pressed exit during MQTT connection
-                            if oled:
-                                show_text_on_oled(["Exiting..."])
-                            print("Exiting Kubios HRV")
-                            return
-                        elif mqtt_client:
-                            # Get clean HRV data from HRVMonitor
-                            hrv_data = get_hrv_data()
-                            if hrv_data and len(hrv_data) >= 10:
-                                if oled:
-                                    show_text_on_oled([
-                                        "SENDING CLEAN",
-                                        "HRV DATA",
-                                        "Beats: %d" % len(hrv_data),
-                                        "Please wait..."
-                                    ])
-                                result = send_hrv_request(hrv_data)
-                            else:
-                                if oled:
-                                    show_text_on_oled([
-                                        "NO CLEAN DATA",
-                                        "Need 30+ total beats",
-                                        "in HRVMonitor",
-                                        "Using test data..."
-                                    ])
-                                utime.sleep(3)
-                                result = send_hrv_request()  # Use test data
-                            
-                            if result == "EXIT_REQUESTED":
-                                if oled:
-                                    show_text_on_oled(["Exiting..."])
-                                print("Exiting Kubios HRV")
-                                return
-                            elif not result:
-                                utime.sleep(2)  # Show error message briefly
-                        else:
+                    elif mqtt_client:
+                        # Get clean HRV data from HRVMonitor
+                        hrv_data = get_hrv_data()
+                        if hrv_data and len(hrv_data) >= 10:
                             if oled:
                                 show_text_on_oled([
-                                    "MQTT failed",
-                                    "",
-                                    "Check settings"
+                                    "SENDING CLEAN",
+                                    "HRV DATA",
+                                    "Beats: %d" % len(hrv_data),
+                                    "Please wait..."
                                 ])
-                            utime.sleep(2)
-                    else:
-                        if oled:
-                            show_text_on_oled([
-                                "WiFi failed",
-                                "",
-                                "Check network"
-                            ])
-                        utime.sleep(2)
-                
-                # Wait for button release
-                while not nav_btn.value():
-                    # Check exit button even while waiting for nav button release
-                    if not exit_btn.value():
-                        utime.sleep_ms(50)
-                        if not exit_btn.value():
+                            result = send_hrv_request(hrv_data)
+                        else:
                             if oled:
-                                show_text_on_oled(["Exiting..."])
+                                show_text_on_oled(_SCR_NO_CLEAN_DATA)
+                            utime.sleep(3)
+                            result = send_hrv_request()  # Use test data
+                        
+                        if result == "EXIT_REQUESTED":
+                            if oled:
+                                show_text_on_oled(_SCR_EXITING)
                             print("Exiting Kubios HRV")
-                            if mqtt_client:
-                                try:
-                                    mqtt_client.disconnect()
-                                except:
-                                    pass
                             return
-                    utime.sleep_ms(10)
+                        elif not result:
+                            utime.sleep(2)  # Show error message briefly
+                    else:
+                        if oled:
+                            show_text_on_oled(_SCR_MQTT_FAILED)
+                        utime.sleep(2)
+                else:
+                    if oled:
+                        show_text_on_oled(_SCR_WIFI_FAILED)
+                    utime.sleep(2)
+            
+            # Ignore presses and encoder steps that arrived while busy
+            nav_pressed(enc)
 
-        utime.sleep_ms(10)
+        sleep_ms(IDLE_MS)
 
 # Menu compatibility
 def main(exit_button=None, display=None, enc=None):
@@ -1,189 +1,287 @@
 # Settings application could be worth it?
 
-from machine import Pin, I2C
-from ssd1306 import SSD1306_I2C
+from machine import Pin, idle
 from fifo import Fifo
+from programs import PROGRAM_MODULES
+import oled_util
+import framebuf
 import time
+import gc
 import os
 
 # ----- CONFIG -----
 WIDTH, HEIGHT = 128, 64
-I2C_SDA, I2C_SCL = 14, 15
 ENC_A, ENC_B, ENC_BTN = 10, 11, 12
 EXIT_BTN = 9  # SW_0 button
+BTN_EVENT = 0x1000  # Queued in the encoder FIFO by the button IRQ, never a rotation step
+BTN_DEBOUNCE_MS = 200
 
 # ----- DISPLAY -----
-# Initialize display with error handling
+# Shared display: reuses the one main.py created for the startup animation
 def init_display():
-    try:
-        i2c = I2C(1, scl=Pin(I2C_SCL), sda=Pin(I2C_SDA))
-        oled = SSD1306_I2C(WIDTH, HEIGHT, i2c)
+    oled = oled_util.init_oled()
+    if oled:
         print("Display initialized successfully")
-        return oled
-    except Exception as e:
-        print("Display initialization failed:", e)
-        return None
+    else:
+        print("Display initialization failed")
+    return oled
 
 oled = init_display()
 
+# ----- PARTIAL DISPLAY UPDATE -----
+write_pages = oled_util.write_pages  # One window command + one data write per range
+show_fast = oled_util.show_fast
+
+def invalidate_display():
+    """Forget what is on the panel, the next menu draw sends the full buffer"""
+    global _last_drawn
+    _last_drawn = -1
+
+# ----- PROGRAMS -----
+# Menu item -> module, built from programs.PROGRAM_MODULES.
+# Imported at boot (behind the "Loading..." screen) and before the encoder IRQs
+# are set up. A module that fails to load is retried at launch to show the error
+_PROGRAMS = {}
+for _name, _modname in PROGRAM_MODULES:
+    try:
+        _PROGRAMS[_name] = __import__(_modname)
+    except Exception as e:
+        print(f"Could not preload {_modname}: {e}")
+        _PROGRAMS[_name] = _modname
+
+# Start from a compacted heap, and collect automatically once another quarter
+# of the free heap is allocated so each GC pause stays short
+gc.collect()
+gc.threshold(gc.mem_free() // 4 + gc.mem_alloc())
+
 # ----- ENCODER USING INTERRUPT + FIFO -----
+# Quadrature transition table indexed by (previous AB << 2) | current AB.
+# A leading B (00 -> 10 -> 11 -> 01) is clockwise (+1), invalid jumps and
+# bounces back and forth sum to 0
+_QTAB = (0, -1, 1, 0, 1, 0, 0, -1, -1, 0, 0, 1, 0, 1, -1, 0)
+STEPS_PER_DETENT = 4  # Transitions per click, one FIFO step per click
+DETENT_AB = 0b11  # Both pins pulled high while the knob rests in a detent
+
 class Encoder:
     def __init__(self, pin_a, pin_b):
         self.a = Pin(pin_a, mode=Pin.IN, pull=Pin.PULL_UP)
         self.b = Pin(pin_b, mode=Pin.IN, pull=Pin.PULL_UP)
         self.fifo = Fifo(100, typecode='i')  # Increased size to prevent overflow
+        # Bound methods for the IRQ handler
+        self._a = self.a.value
+        self._b = self.b.value
+        self._put = self.fifo.put
+        self._has_room = self.fifo.has_room
+        self._prev_ab = (self._a() << 1) | self._b()
+        self._acc = 0
 
-        self.a.irq(handler=self.handler, trigger=Pin.IRQ_RISING, hard=True)
+        trigger = Pin.IRQ_RISING | Pin.IRQ_FALLING
+        self.a.irq(handler=self.handler, trigger=trigger, hard=True)
+        self.b.irq(handler=self.handler, trigger=trigger, hard=True)
 
     def handler(self, pin):
-        # Simple direction logic: if B is high, counterclockwise
-        # Add protection against FIFO overflow
-        try:
-            if self.b():
-                self.fifo.put(-1)
-            else:
-                self.fifo.put(1)
-        except:
-            # FIFO full - ignore this input to prevent crash
-            pass
+        # Hard IRQ: no allocation, so check for room instead of catching put()'s
+        # exception. Decode every edge of A and B, emit +/-1 once per detent
+        ab = (self._a() << 1) | self._b()
+        acc = self._acc + _QTAB[(self._prev_ab << 2) | ab]
+        self._prev_ab = ab
+        if ab == DETENT_AB:
+            # Back at rest: a full detent sums to +/-4, a skipped (double-jump)
+            # transition to +/-2, a bounce to 0. Resync so no error carries over
+            if acc >= STEPS_PER_DETENT // 2 or acc <= -(STEPS_PER_DETENT // 2):
+                if self._has_room():
+                    self._put(1 if acc > 0 else -1)
+            acc = 0
+        self._acc = acc
 
 # Create encoder and buttons
 encoder = Encoder(ENC_A, ENC_B)
 btn = Pin(ENC_BTN, Pin.IN, Pin.PULL_UP)
 exit_btn = Pin(EXIT_BTN, Pin.IN, Pin.PULL_UP)
 
+# ----- BUTTON USING INTERRUPT + SHARED FIFO -----
+_btn_last_ms = 0
+
+def btn_handler(pin):
+    # Hard IRQ: ignore bounces, queue the press behind any pending rotation
+    global _btn_last_ms
+    now = time.ticks_ms()
+    if time.ticks_diff(now, _btn_last_ms) < BTN_DEBOUNCE_MS:
+        return
+    _btn_last_ms = now
+    if encoder.fifo.has_room():
+        encoder.fifo.put(BTN_EVENT)
+
+def attach_btn_irq():
+    btn.irq(handler=btn_handler, trigger=Pin.IRQ_FALLING, hard=True)
+
+def detach_btn_irq():
+    # Programs get the encoder FIFO, so they must not see menu button events
+    btn.irq(handler=None)
+
 # ----- MENU ITEMS -----
-menu_items = [
-    "HRV Monitor",
-    "Kubios HRV",
-    "HRV History"
-]
+menu_items = [name for name, _ in PROGRAM_MODULES]
 selected = 0
 
+# ----- PRE-RENDERED ROWS -----
+# A 16 px row is two whole display pages, i.e. 256 contiguous bytes of the
+# MONO_VLSB framebuffer, so each item is rendered once and then just copied
+ROW_H = 16
+ROW_PAGES = ROW_H // 8
+ROW_BYTES = WIDTH * ROW_PAGES
+VISIBLE_ROWS = HEIGHT // ROW_H
+
+def render_row(text, highlight):
+    buf = bytearray(ROW_BYTES)
+    fb = framebuf.FrameBuffer(buf, WIDTH, ROW_H, framebuf.MONO_VLSB)
+    if highlight:
+        fb.fill(1)
+        fb.text(text, 2, 4, 0)
+    else:
+        fb.text(text, 2, 4, 1)
+    return buf
+
+rendered_normal = [render_row(item, False) for item in menu_items]
+rendered_highlight = [render_row(item, True) for item in menu_items]
+
+# Console fallback lines (no display), one per selection
+_CONSOLE_MENUS = tuple(
+    f"Menu: {[f'> {item}' if i == sel else f'  {item}' for i, item in enumerate(menu_items)]}"
+    for sel in range(len(menu_items))
+)
+
+# Full-screen backgrounds for the launch/error splashes, only the second line
+# (program name / error text) is drawn at runtime
+def render_splash(label):
+    buf = bytearray(WIDTH * HEIGHT // 8)
+    fb = framebuf.FrameBuffer(buf, WIDTH, HEIGHT, framebuf.MONO_VLSB)
+    fb.text(label, 0, 20)
+    return buf
+
+_LAUNCH_BG = render_splash("Launching:")
+_ERROR_BG = render_splash("Error:")
+
 # ----- DRAW MENU -----
+_last_drawn = -1  # Selection currently shown, -1 = menu not on screen
+_last_start = 0   # First visible item when _last_drawn was drawn
+
+def copy_row(buf, i, start, selected):
+    off = (i - start) * ROW_BYTES
+    cache = rendered_highlight if i == selected else rendered_normal
+    buf[off:off + ROW_BYTES] = cache[i]
+
 def draw_menu(selected):
-    global oled
+    global oled, _last_drawn, _last_start
+    if selected == _last_drawn:
+        return  # Clamped at either end of the list, nothing to redraw
     if oled is None:
         # Print to console if no display
-        print(f"Menu: {[f'> {item}' if i == selected else f'  {item}' for i, item in enumerate(menu_items)]}")
+        print(_CONSOLE_MENUS[selected])
+        _last_drawn = selected
         return
     
     try:
-        oled.fill(0)
+        buf = oled.buffer
         start = max(0, selected - 2)
-        end = min(len(menu_items), start + 4)
-        for i in range(start, end):
-            y = (i - start) * 16
-            if i == selected:
-                oled.fill_rect(0, y, WIDTH, 16, 1)
-                oled.text(menu_items[i], 2, y + 4, 0)
-            else:
-                oled.text(menu_items[i], 2, y + 4, 1)
-        oled.show()
+        if _last_drawn >= 0 and start == _last_start:
+            # Same window: only the old and new highlighted rows change, send
+            # the pages from the upper one to the lower one
+            copy_row(buf, _last_drawn, start, selected)
+            copy_row(buf, selected, start, selected)
+            top = min(_last_drawn, selected) - start
+            bottom = max(_last_drawn, selected) - start
+            write_pages(top * ROW_PAGES, (bottom + 1) * ROW_PAGES - 1)
+        else:
+            # First draw, scrolled, or a program drew over the panel
+            oled.fill(0)
+            end = min(len(menu_items), start + VISIBLE_ROWS)
+            for i in range(start, end):
+                copy_row(buf, i, start, selected)
+            show_fast()
+        _last_drawn = selected
+        _last_start = start
     except OSError as e:
         if e.errno == 110:  # ETIMEDOUT
             print("OLED timeout - disabling display")
             oled = None
             # Fall back to console
-            print(f"Menu: {[f'> {item}' if i == selected else f'  {item}' for i, item in enumerate(menu_items)]}")
+            print(_CONSOLE_MENUS[selected])
         else:
             raise
 
 # ----- PROGRAM RUNNER -----
+def _show_error(name, e):
+    print(f"Error running {name}: {e}")
+    if oled:
+        oled.buffer[:] = _ERROR_BG
+        oled.text(str(e)[:12], 0, 40)
+        show_fast()
+    time.sleep(2)
+
 def run_program(name):
     print(f"Launching: {name}")
+    detach_btn_irq()
     if oled:
-        oled.fill(0)
-        oled.text("Launching:", 0, 20)
+        oled.buffer[:] = _LAUNCH_BG
         oled.text(name, 0, 40)
-        oled.show()
+        show_fast()
     time.sleep(1)
 
-    if name == "HRV Monitor":
+    mod = _PROGRAMS.get(name)
+    if mod:
         try:
-            import HRVMonitor
-            if hasattr(HRVMonitor, "main"):
-                HRVMonitor.main(exit_btn, oled, encoder)
+            if isinstance(mod, str):
+                mod = __import__(mod)
+            if hasattr(mod, "main"):
+                mod.main(exit_btn, oled, encoder)
         except Exception as e:
-            print(f"Error running HRV Monitor: {e}")
-            if oled:
-                oled.fill(0)
-                oled.text("Error:", 0, 20)
-                oled.text(str(e)[:12], 0, 40)
-                oled.show()
-            time.sleep(2)
-            
-    elif name == "Kubios HRV":
-        try:
-            import KubiosHRV
-            if hasattr(KubiosHRV, "main"):
-                KubiosHRV.main(exit_btn, oled, encoder)
-        except Exception as e:
-            print(f"Error running Kubios HRV: {e}")
-            if oled:
-                oled.fill(0)
-                oled.text("Error:", 0, 20)
-                oled.text(str(e)[:12], 0, 40)
-                oled.show()
-            time.sleep(2)
-            
-    elif name == "HRV History":
-        try:
-            import HRVHistory
-            if hasattr(HRVHistory, "main"):
-                HRVHistory.main(exit_btn, oled, encoder)
-        except Exception as e:
-            print(f"Error running HRV History: {e}")
-            if oled:
-                oled.fill(0)
-                oled.text("Error:", 0, 20)
-                oled.text(str(e)[:12], 0, 40)
-                oled.show()
-            time.sleep(2)
-    
+            _show_error(name, e)
     else:
         print("No program available")
         if oled:
             oled.fill(0)
             oled.text("No program", 0, 20)
             oled.text("available", 0, 36)
-            oled.show()
+            show_fast()
         time.sleep(1)
 
-    # Clear encoder FIFO to avoid stale inputs when returning to menu
-    while encoder.fifo.has_data():
-        encoder.fifo.get()
+    # Clear encoder FIFO to avoid stale inputs when returning to menu, then
+    # take the button back (a program may have replaced its IRQ)
+    encoder.fifo.clear()
+    attach_btn_irq()
+    gc.collect()  # Free the program's garbage now rather than mid-redraw
     
-    # Redraw menu after program ends
+    # Redraw menu after program ends, the program has drawn over it
+    invalidate_display()
     draw_menu(selected)
 
 # ----- MAIN LOOP -----
 draw_menu(selected)
-last_move_time = time.ticks_ms()
+attach_btn_irq()
 
 while True:
+    # Sleep until the encoder or button IRQ queues an event
+    while not encoder.fifo.has_data():
+        idle()
+
+    # Coalesce every queued rotation step into one redraw, stop at a press
+    delta = 0
+    pressed = False
+    while encoder.fifo.has_data():
+        ev = encoder.fifo.get()
+        if ev == BTN_EVENT:
+            pressed = True
+            break
+        delta += ev
+
     # --- Rotary movement ---
-    if encoder.fifo.has_data():
-        try:
-            move = encoder.fifo.get()
-            selected = max(0, min(len(menu_items) - 1, selected + move))
-            draw_menu(selected)
-        except Exception as e:
-            print(f"Encoder error: {e}")
-            # Clear FIFO on error to recover
-            while encoder.fifo.has_data():
-                try:
-                    encoder.fifo.get()
-                except:
-                    break
+    if delta:
+        selected = max(0, min(len(menu_items) - 1, selected + delta))
+        draw_menu(selected)
 
     # --- Button press to launch ---
-    if not btn.value():
+    if pressed:
         # Clear any pending encoder inputs before launching program
-        while encoder.fifo.has_data():
-            encoder.fifo.get()
-        
-        run_program(menu_items[selected])
-        time.sleep(0.5)  # debounce
+        encoder.fifo.clear()
 
-    time.sleep(0.01)
\ No newline at end of file
+        run_program(menu_items[selected])
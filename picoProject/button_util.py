@@ -0,0 +1,40 @@
+# Button util - IRQ latched, time debounced button presses for the programs
+
+import machine
+import utime
+
+# ----------------- CONFIG -----------------
+DEBOUNCE_MS = 200  # Edges closer than this to the last accepted press are bounce
+
+# ----------------- BUTTON -----------------
+class Button:
+    """A press is the falling edge itself, so even a short tap is never missed"""
+    def __init__(self, pin, debounce_ms=DEBOUNCE_MS):
+        self.pin = pin
+        self.debounce_ms = debounce_ms
+        self._pressed = False
+        self._last_ms = utime.ticks_add(utime.ticks_ms(), -debounce_ms)
+
+    def _handler(self, pin):
+        # Hard IRQ: no allocation, ignore bounces after the accepted edge
+        now = utime.ticks_ms()
+        if utime.ticks_diff(now, self._last_ms) < self.debounce_ms:
+            return
+        self._last_ms = now
+        self._pressed = True
+
+    def attach(self):
+        """Start latching presses, dropping any left from an earlier run"""
+        self._pressed = False
+        self.pin.irq(handler=self._handler, trigger=machine.Pin.IRQ_FALLING, hard=True)
+
+    def detach(self):
+        """Release the interrupt when leaving, the pins are shared with the menu"""
+        self.pin.irq(handler=None)
+
+    def pressed(self):
+        """Consume a pending press, True if there was one"""
+        if not self._pressed:
+            return False
+        self._pressed = False
+        return True
@@ -50,6 +50,14 @@ class Fifo:
         """Return number of dropped items. A return value that is greater than zero means that fifo is emptied too slowly.""" 
         return self.dc
 
+    def has_room(self):
+        """Returns True if put() can store another item without raising"""
+        return (self.head + 1) % self.size != self.tail
+
+    def clear(self):
+        """Discard all items in O(1). Only moves tail (the reader's index), so it is safe against a concurrent put() from an ISR"""
+        self.tail = self.head
+
     def has_data(self):
         """Returns True if there is data in the fifo"""
         return self.head != self.tail
@@ -2,15 +2,52 @@
 # Animated heart startup screen
 
 import time
+import gc
+import framebuf
+from programs import PROGRAM_MODULES
+
+# Heart bitmaps (MONO_VLSB), built once. The data are bytes constants in the
+# compiled module (no int list to build at import), copied into bytearrays
+# because FrameBuffer needs a writable buffer
+_HEART_SMALL = bytearray(  # 13x13 pixels
+    b"\x7C\xFE\xFF\xFF\xFF\xFE\xFC\xFE\xFF\xFF\xFF\xFE\x7C"
+    b"\x00\x00\x01\x03\x07\x0F\x1F\x0F\x07\x03\x01\x00\x00"
+)
+_HEART_MEDIUM = bytearray(  # 16x16 pixels
+    b"\xF8\xFC\xFE\xFF\xFF\xFE\xFC\xF8\xF8\xFC\xFE\xFF\xFF\xFE\xFC\xF8"
+    b"\x03\x07\x0F\x1F\x3F\x7F\xFF\xFF\xFF\xFF\x7F\x3F\x1F\x0F\x07\x03"
+)
+_HEART_LARGE = bytearray(  # 20x20 pixels
+    b"\xF0\xF8\xFC\xFE\xFF\xFF\xFF\xFE\xFC\xF8\xF8\xFC\xFE\xFF\xFF\xFF\xFE\xFC\xF8\xF0"
+    b"\x07\x0F\x1F\x3F\x7F\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\xFF\x7F\x3F\x1F\x0F\x07"
+    b"\x00\x00\x00\x00\x00\x00\x01\x03\x07\x0F\x0F\x07\x03\x01\x00\x00\x00\x00\x00\x00"
+)
+_HEART_FRAMES = (
+    (13, 13, framebuf.FrameBuffer(_HEART_SMALL, 13, 13, framebuf.MONO_VLSB)),
+    (16, 16, framebuf.FrameBuffer(_HEART_MEDIUM, 16, 16, framebuf.MONO_VLSB)),
+    (20, 20, framebuf.FrameBuffer(_HEART_LARGE, 20, 20, framebuf.MONO_VLSB)),
+)
+
+# Program modules the menu loads at startup, imported in the animation's idle time
+PRELOAD_MODULES = [modname for _, modname in PROGRAM_MODULES]
+
+def preload_next():
+    """Import the next pending program module, False once all are loaded"""
+    if not PRELOAD_MODULES:
+        return False
+    name = PRELOAD_MODULES.pop(0)
+    try:
+        __import__(name)
+    except Exception as e:
+        # Menu retries it and shows the error when the program is launched
+        print("Preload failed:", name, e)
+    return True
 
 def init_display():
+    # Shared instance, Menu picks up the same display instead of re-initializing it
     try:
-        from machine import Pin, I2C
-        from ssd1306 import SSD1306_I2C
-        
-        i2c = I2C(1, scl=Pin(15), sda=Pin(14))
-        oled = SSD1306_I2C(128, 64, i2c)
-        return oled
+        import oled_util
+        return oled_util.init_oled()
     except:
         return None
 
@@ -20,45 +57,13 @@ def draw_heart_frame(oled, frame):
     
     oled.fill(0)
     
-    # Heart animation frames
-    if frame == 0 or frame == 3:  # Small heart - 13x13 pixels
-        width, height = 13, 13
-        heart_data = bytearray([
-            0x7C, 0xFE, 0xFF, 0xFF, 0xFF, 0xFE, 0xFC, 0xFE,
-            0xFF, 0xFF, 0xFF, 0xFE, 0x7C, 0x00, 0x00, 0x01,
-            0x03, 0x07, 0x0F, 0x1F, 0x0F, 0x07, 0x03, 0x01,
-            0x00, 0x00
-        ])
-        
-    elif frame == 1:  # Medium heart - 16x16 pixels
-        width, height = 16, 16
-        heart_data = bytearray([
-            0xF8, 0xFC, 0xFE, 0xFF, 0xFF, 0xFE, 0xFC, 0xF8, 
-            0xF8, 0xFC, 0xFE, 0xFF, 0xFF, 0xFE, 0xFC, 0xF8, 
-            0x03, 0x07, 0x0F, 0x1F, 0x3F, 0x7F, 0xFF, 0xFF, 
-            0xFF, 0xFF, 0x7F, 0x3F, 0x1F, 0x0F, 0x07, 0x03
-        ])
-        
-    else:  # frame == 2, Large heart - 20x20 pixels
-        width, height = 20, 20
-        heart_data = bytearray([
-            0xF0, 0xF8, 0xFC, 0xFE, 0xFF, 0xFF, 0xFF, 0xFE, 
-            0xFC, 0xF8, 0xF8, 0xFC, 0xFE, 0xFF, 0xFF, 0xFF, 
-            0xFE, 0xFC, 0xF8, 0xF0, 0x07, 0x0F, 0x1F, 0x3F, 
-            0x7F, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 
-            0xFF, 0xFF, 0xFF, 0x7F, 0x3F, 0x1F, 0x0F, 0x07, 
-            0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x01, 0x03, 
-            0x07, 0x0F, 0x0F, 0x07, 0x03, 0x01, 0x00, 0x00, 
-            0x00, 0x00, 0x00, 0x00
-        ])
+    # Heart animation frames: 0/3 small, 1 medium, 2 large
+    width, height, fbuf = _HEART_FRAMES[frame if frame < 3 else 0]
     
     # Calculate center position for 128x64 screen
     start_x = (128 - width) // 2
     start_y = (64 - height) // 2
     
-    import framebuf
-    
-    fbuf = framebuf.FrameBuffer(heart_data, width, height, framebuf.MONO_VLSB)
     oled.blit(fbuf, start_x, start_y)
     
     # Add text at bottom
@@ -69,19 +74,35 @@ def show_heart_animation(oled, duration=3):
     if oled is None:
         print("🫀 HRV SYSTEM 🫀")
         print("♥ Starting... ♥")
-        time.sleep(duration)
+        end = time.ticks_add(time.ticks_ms(), int(duration * 1000))
+        while preload_next():
+            pass
+        remaining = time.ticks_diff(end, time.ticks_ms())
+        if remaining > 0:
+            time.sleep_ms(remaining)
         return
     
     frames = [0, 1, 2, 1]  # Small -> Medium -> Large -> Medium -> repeat
     beats_per_second = 1.2
     frame_duration = 1.0 / (beats_per_second * len(frames))
     
+    frame_ms = int(frame_duration * 1000)
     total_frames = int(duration / frame_duration)
     
+    # Collect before the first frame so GC doesn't stall the animation
+    gc.collect()
+    
+    # Sleep to absolute deadlines so the I2C time of each draw doesn't stretch the beat
+    deadline = time.ticks_ms()
     for i in range(total_frames):
         frame_index = i % len(frames)
         draw_heart_frame(oled, frames[frame_index])
-        time.sleep(frame_duration)
+        deadline = time.ticks_add(deadline, frame_ms)
+        # Use the wait for this frame to load one module
+        preload_next()
+        remaining = time.ticks_diff(deadline, time.ticks_ms())
+        if remaining > 0:
+            time.sleep_ms(remaining)
     
     # Final loading screen
     oled.fill(0)
@@ -0,0 +1,89 @@
+# OLED util - Shared SSD1306 display and text screen helper
+
+import machine
+try:
+    import ssd1306
+except:
+    ssd1306 = None
+
+# ----------------- CONFIG -----------------
+I2C_SCL = 15
+I2C_SDA = 14
+OLED_ENABLED = ssd1306 is not None
+OLED_WIDTH = 128
+OLED_HEIGHT = 64
+I2C_FREQ = 1_000_000  # SSD1306 handles 1 MHz, ~10x faster show() than the default
+I2C_FREQ_SAFE = 400_000  # Fallback if the panel doesn't answer at I2C_FREQ
+SET_COL_ADDR = 0x21   # SSD1306 column window command
+SET_PAGE_ADDR = 0x22  # SSD1306 page window command
+PAGES = OLED_HEIGHT // 8  # 8-pixel rows, one OLED_WIDTH-byte slice of the buffer each
+
+# ----------------- GLOBALS -----------------
+oled = None  # The one display instance shared by main, Menu and the programs
+_last_lines = None  # Lines currently on the display
+# Reused I2C buffers: a command stream (0x00 control byte) setting the column/page
+# window, its page bytes are patched per write, and the data-stream prefix
+_WIN_CMD = bytearray([0x00, SET_COL_ADDR, 0, OLED_WIDTH - 1, SET_PAGE_ADDR, 0, 0])
+_DATA_PREFIX = b"\x40"
+
+# ----------------- DISPLAY -----------------
+def init_oled():
+    """Create the shared display on first use, returns None if unavailable"""
+    global oled
+    if oled is None and OLED_ENABLED:
+        for freq in (I2C_FREQ, I2C_FREQ_SAFE):
+            try:
+                i2c = machine.I2C(1, scl=machine.Pin(I2C_SCL),
+                                  sda=machine.Pin(I2C_SDA), freq=freq)
+                oled = ssd1306.SSD1306_I2C(OLED_WIDTH, OLED_HEIGHT, i2c)
+                break
+            except:
+                oled = None
+        if oled is None:
+            print("OLED initialization failed")
+    return oled
+
+def set_display(display):
+    """Use a display created elsewhere (e.g. passed in by the menu)"""
+    global oled
+    oled = display
+    invalidate()
+    return oled
+
+def invalidate():
+    """Forget the shown lines, call when someone else may have drawn the display"""
+    global _last_lines
+    _last_lines = None
+
+def show_text(lines):
+    global _last_lines
+    if oled is None:
+        return
+    # Skip the redraw and I2C transfer if the screen content is unchanged
+    t = tuple(lines)
+    if t == _last_lines:
+        return
+    _last_lines = t
+    oled.fill(0)
+    y = 0
+    for line in lines:
+        oled.text(str(line), 0, y)
+        y += 10
+        if y > OLED_HEIGHT-10:
+            break
+    oled.show()
+
+def write_pages(first, last):
+    """Send pages first..last of the buffer: one window command, one data write"""
+    _WIN_CMD[5] = first
+    _WIN_CMD[6] = last
+    try:
+        oled.i2c.writeto(oled.addr, _WIN_CMD)
+        oled.i2c.writevto(oled.addr, (_DATA_PREFIX, memoryview(oled.buffer)[first * OLED_WIDTH:(last + 1) * OLED_WIDTH]))
+    except AttributeError:
+        # Not an SSD1306_I2C driver, push the whole frame
+        oled.show()
+
+def show_fast():
+    """Full-frame show() without the driver's six separate command writes"""
+    write_pages(0, PAGES - 1)
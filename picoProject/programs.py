@@ -0,0 +1,9 @@
+# Programs - The menu's items and the modules that implement them
+
+# (menu item, module with a main(exit_button, display, enc) entry point), in menu
+# order. Menu builds its items and launch table from this, main preloads the modules
+PROGRAM_MODULES = (
+    ("HRV Monitor", "HRVMonitor"),
+    ("Kubios HRV", "KubiosHRV"),
+    ("HRV History", "HRVHistory"),
+)
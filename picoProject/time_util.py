@@ -0,0 +1,39 @@
+# Time util - Shared wall-clock timestamp for database records and history
+
+import utime
+
+# ----------------- CONFIG -----------------
+NTP_RESYNC_S = 3600  # RTC keeps time between syncs, drift is seconds per day
+# Fallback when NTP has never succeeded: Dec 4, 2025 9:06 UTC, plus uptime
+APPROX_BASE_TIME = 1764839160
+
+# ----------------- GLOBALS -----------------
+_ntp_synced = False
+_ntp_last = 0  # utime.time() right after the last successful sync
+
+# ----------------- TIMESTAMP -----------------
+def get_timestamp():
+    """Get Unix timestamp, syncing the RTC with NTP only when needed"""
+    global _ntp_synced, _ntp_last
+    if _ntp_synced and 0 <= utime.time() - _ntp_last <= NTP_RESYNC_S:
+        return utime.time()
+
+    try:
+        import ntptime
+        print("Syncing time with NTP server...")
+        # settime() sets the RTC, utime.time() returns the Unix timestamp from then on
+        ntptime.settime()
+        timestamp = utime.time()
+        _ntp_synced = True
+        _ntp_last = timestamp
+        print("Time synced, timestamp:", timestamp)
+        return timestamp
+    except Exception as e:
+        if _ntp_synced:
+            # RTC was set by an earlier sync and is still close enough
+            print("NTP resync failed, keeping RTC time:", e)
+            return utime.time()
+        print("NTP sync failed, using approximate time:", e)
+        timestamp = APPROX_BASE_TIME + utime.ticks_ms() // 1000
+        print("Using approximate timestamp:", timestamp)
+        return timestamp